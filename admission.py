@@ -0,0 +1,186 @@
+import asyncio
+import time
+from collections import OrderedDict
+from outbox import message
+
+
+class Admission:
+    """Decides who may order, so a drop never buries the kitchen.
+
+    Two caps, both stored as settings and 0 meaning no limit: how many orders
+    may be pending at once, and how many orders one drop (the time since the
+    shop last opened) may take. Checkouts in progress hold a slot from the
+    moment they pass the check until their write commits, and everything
+    runs on the event loop, so the check-and-take cannot race.
+
+    Whoever is turned away joins a waitlist (kept in the db too). When orders
+    are served, the freed slots go to the front of the waitlist as invites:
+    they are messaged in order and their slot is held for `invite_ttl`
+    seconds before it goes to the next in line. While anyone is waiting,
+    newcomers are turned away, so a slot freed some other way (a checkout
+    that failed, an invite that lapsed) also goes to the front of the line.
+    """
+
+    def __init__(self, db, default_max_pending=0, default_max_per_drop=0, invite_ttl=600):
+        self.db = db
+        self.default_max_pending = default_max_pending
+        self.default_max_per_drop = default_max_per_drop
+        self.invite_ttl = invite_ttl
+        self.in_flight = 0
+        self.drop_orders = 0
+        self.turned_away = 0
+        self.waitlist = OrderedDict() #user_id -> chat_id, oldest first
+        self.invites = OrderedDict() #user_id -> when their held slot expires
+        self._checking_out = {} #user_id -> checkouts in progress, their slot is in in_flight already
+        self._timer = None #wakes up when the next invite lapses
+        self._refills = set() #refills started from sync code, kept so they aren't collected
+
+    async def load(self):
+        started = float(self.db.get_setting('drop_started_at', '0'))
+        if not started: #first run, count the drop from now
+            started = time.time()
+            await self.db.set_setting('drop_started_at', started)
+        self.drop_orders = await self.db.count_orders_since(started)
+        self.waitlist = OrderedDict((row['user_id'], row['chat_id']) for row in await self.db.get_waitlist())
+        await self.refill() #invites don't survive a restart, and newcomers wait behind the line
+
+    @property
+    def max_pending(self):
+        return int(self.db.get_setting('max_pending', self.default_max_pending))
+
+    @property
+    def max_per_drop(self):
+        return int(self.db.get_setting('max_per_drop', self.default_max_per_drop))
+
+    async def set_caps(self, max_pending=None, max_per_drop=None):
+        if max_pending is not None:
+            await self.db.set_setting('max_pending', max_pending)
+        if max_per_drop is not None:
+            await self.db.set_setting('max_per_drop', max_per_drop)
+        await self.refill()
+
+    async def new_drop(self):
+        #the shop just opened, the per-drop count starts again
+        self.drop_orders = 0
+        await self.db.set_setting('drop_started_at', time.time())
+        await self.refill()
+
+    #checks ###############################################################################
+
+    def _room(self):
+        #free slots right now, None if nothing is capped
+        rooms = []
+        if self.max_pending:
+            rooms.append(self.max_pending - len(self.db.pending) - self.in_flight)
+        if self.max_per_drop:
+            rooms.append(self.max_per_drop - self.drop_orders - self.in_flight)
+        return min(rooms) if rooms else None
+
+    def _held(self):
+        #slots held for invites, an invited user checking out is counted in in_flight instead
+        return sum(1 for user_id in self.invites if user_id not in self._checking_out)
+
+    def _expire_invites(self):
+        #returns how many lapsed, their slots are free again
+        now = time.time()
+        lapsed = [u for u, expires in self.invites.items() if expires < now]
+        for user_id in lapsed:
+            del self.invites[user_id]
+        return len(lapsed)
+
+    def _refill_soon(self):
+        #for sync callers, only worth a task if someone is waiting for the slot
+        if self.waitlist:
+            task = asyncio.create_task(self.refill())
+            self._refills.add(task)
+            task.add_done_callback(self._refills.discard)
+
+    def drop_full(self):
+        return bool(self.max_per_drop) and self.drop_orders + self.in_flight >= self.max_per_drop
+
+    def can_enter(self, user_id):
+        if self._expire_invites():
+            self._refill_soon()
+        if user_id in self.invites:
+            return True
+        if self.waitlist: #first come first served, freed slots go to the line via refill
+            return False
+        room = self._room()
+        return room is None or room - self._held() > 0
+
+    def reserve(self, user_id):
+        #take a slot for a checkout, give it back with release()
+        if not self.can_enter(user_id):
+            return False
+        self.in_flight += 1
+        self._checking_out[user_id] = self._checking_out.get(user_id, 0) + 1
+        return True
+
+    def release(self, user_id, ordered):
+        self.in_flight -= 1
+        self._checking_out[user_id] -= 1
+        if not self._checking_out[user_id]:
+            del self._checking_out[user_id]
+        if ordered:
+            self.drop_orders += 1
+            self.invites.pop(user_id, None)
+        else: #the slot was not used
+            self._refill_soon()
+
+    #waitlist #############################################################################
+
+    async def wait(self, user_id, chat_id):
+        #returns their 1-based place in line
+        self.turned_away += 1
+        if user_id not in self.waitlist:
+            self.waitlist[user_id] = chat_id
+            await self.db.join_waitlist(user_id, chat_id, time.time())
+        return list(self.waitlist).index(user_id) + 1
+
+    def position(self, user_id):
+        return list(self.waitlist).index(user_id) + 1 if user_id in self.waitlist else None
+
+    async def refill(self):
+        #hand freed slots to the front of the waitlist
+        self._expire_invites()
+        if not self.waitlist or self.drop_full():
+            return
+        room = self._room()
+        free = len(self.waitlist) if room is None else room - self._held()
+        invited = []
+        while free > 0 and self.waitlist: #picked synchronously, so two refills never invite the same person
+            user_id, chat_id = self.waitlist.popitem(last=False)
+            self.invites[user_id] = time.time() + self.invite_ttl
+            invited.append((user_id, chat_id))
+            free -= 1
+        if invited:
+            self._schedule_lapse()
+            minutes = f"{self.invite_ttl / 60:g}"
+            await self.db.leave_waitlist([user_id for user_id, _ in invited], [message(
+                chat_id,
+                f"🟢 A spot just opened up for you!\nSend /start within {minutes} minutes to place your order."
+            ) for _, chat_id in invited])
+
+    def _schedule_lapse(self):
+        #so the next in line hears about a lapsed invite even if nobody else sends /start
+        if self.invites and self._timer is None:
+            delay = min(self.invites.values()) - time.time() + 0.1 #early wake-ups just schedule again
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0), self._lapsed)
+
+    def _lapsed(self):
+        self._timer = None
+        if self._expire_invites():
+            self._refill_soon()
+        self._schedule_lapse()
+
+    async def stop(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.gather(*self._refills, return_exceptions=True)
+
+    def summary(self):
+        caps = lambda cap: cap or '∞'
+        return (f"{len(self.db.pending)}/{caps(self.max_pending)} pending, "
+                f"{self.drop_orders}/{caps(self.max_per_drop)} this drop, {self.in_flight} checking out, "
+                f"{len(self.waitlist)} waiting, {len(self.invites)} invited, {self.turned_away} turned away")
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+
+class Archiver:
+    """Moves served orders out of the live tables, so they only hold the current drop.
+
+    Every `interval` seconds, orders served more than `after` seconds ago are
+    copied to orders_archive/order_items_archive and deleted from orders/
+    order_items, `batch` at a time so no single write holds up checkouts.
+    Sales rollups are not touched here, they were counted when the orders
+    were served.
+    """
+
+    def __init__(self, db, after=3600, interval=300, batch=500):
+        self.db = db
+        self.after = after
+        self.interval = interval
+        self.batch = batch
+        self.archived = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.archive()
+            except Exception as e: #try again next round
+                print(f"Archiving failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def archive(self):
+        before = time.time() - self.after
+        while True:
+            moved = await self.db.archive_served(before, self.batch)
+            self.archived += moved
+            if moved < self.batch:
+                return
@@ -0,0 +1,131 @@
+"""Checkout latency under concurrent load, old per-call sqlite helpers vs db.Database.
+
+    python -m bench.checkout_latency --customers 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from db import Database
+
+
+#the helpers main.py used before the data layer, kept here for comparison
+def _legacy_init(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE IF NOT EXISTS orders (
+                    id TEXT PRIMARY KEY, customer_id INTEGER, customer_name TEXT,
+                    items TEXT, total REAL, status TEXT)''')
+    conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('shop_open', '1')")
+    conn.commit()
+    conn.close()
+
+def _legacy_is_shop_open(path):
+    conn = sqlite3.connect(path)
+    result = conn.execute("SELECT value FROM settings WHERE key='shop_open'").fetchone()
+    conn.close()
+    return result[0] == '1' if result else True
+
+def _legacy_add_order(path, order_id, customer_id, customer_name, items, total):
+    conn = sqlite3.connect(path)
+    conn.execute("""INSERT INTO orders (id, customer_id, customer_name, items, total, status)
+                    VALUES (?, ?, ?, ?, ?, 'pending')""",
+                 (order_id, customer_id, customer_name, json.dumps(items), total))
+    conn.commit()
+    conn.close()
+
+
+class LegacyStore:
+    def __init__(self, path):
+        self.path = path
+        _legacy_init(path)
+
+    async def is_shop_open(self):
+        return _legacy_is_shop_open(self.path)
+
+    async def add_order(self, *args):
+        _legacy_add_order(self.path, *args)
+
+    def close(self):
+        pass
+
+
+class AsyncStore:
+    batch_window = 0.002
+
+    def __init__(self, path):
+        self.db = Database(path, batch_window=self.batch_window)
+        self.db.init()
+
+    async def is_shop_open(self):
+        return self.db.is_shop_open()
+
+    async def add_order(self, *args):
+        await self.db.add_order(*args)
+
+    def close(self):
+        print(f"  db: {self.db.stats.summary()}")
+        self.db.close()
+
+
+ITEMS = [{'name': 'Classic Acai Bowl (Matcha, Honey Drizzle)', 'price': 6.0, 'request': None}]
+
+
+async def _customer(store, n, arrived, latencies):
+    #latency is counted from when the drop burst arrives, so time spent waiting
+    #behind other customers' blocking calls shows up too
+    await store.is_shop_open()
+    await store.add_order(str(uuid.uuid4()), n, f'user{n}', ITEMS, 6.0)
+    latencies.append(time.perf_counter() - arrived)
+
+
+async def _loop_lag(stop, lags, interval=0.005):
+    #how late the event loop wakes us up = how long other updates would be stuck
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - before - interval)
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def run(store_cls, customers):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = store_cls(os.path.join(tmp, 'bench.db'))
+        latencies, lags = [], []
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(_loop_lag(stop, lags))
+        start = time.perf_counter()
+        await asyncio.gather(*(_customer(store, n, start, latencies) for n in range(customers)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await lag_task
+        store.close()
+
+    ms = [l * 1000 for l in latencies]
+    print(f"{store_cls.__name__:<12} {customers / elapsed:8.0f} checkouts/s  "
+          f"p50 {_pct(ms, 50):7.1f}ms  p95 {_pct(ms, 95):7.1f}ms  p99 {_pct(ms, 99):7.1f}ms  "
+          f"max loop stall {max(lags or [0]) * 1000:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--window-ms', type=float, default=2, help='group commit window')
+    args = parser.parse_args()
+    AsyncStore.batch_window = args.window_ms / 1000
+
+    for store_cls in (LegacyStore, AsyncStore):
+        asyncio.run(run(store_cls, args.customers))
+
+
+if __name__ == '__main__':
+    main()
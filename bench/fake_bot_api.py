@@ -0,0 +1,228 @@
+"""A tiny local stand-in for the Telegram Bot API.
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:<port>. It answers
+the handful of methods main.py uses, hands out updates to getUpdates, and
+records every call so a script can wait for the bot's reply to a given chat.
+"""
+import asyncio
+import json
+import time
+from collections import defaultdict
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qsl
+
+BOT_USER = {'id': 4242, 'is_bot': True, 'first_name': 'Acai Test', 'username': 'acai_test_bot'}
+
+#form fields that carry json rather than plain strings
+JSON_FIELDS = {'chat_id', 'message_id', 'reply_markup', 'offset', 'limit', 'timeout',
+               'allowed_updates', 'show_alert', 'drop_pending_updates', 'max_connections'}
+
+
+class Call:
+    def __init__(self, method, params):
+        self.method = method
+        self.params = params
+        self.at = time.perf_counter()
+        self.result = None
+
+    @property
+    def chat_id(self):
+        return self.params.get('chat_id')
+
+    def buttons(self):
+        #callback_data of every inline button in the call's keyboard, in order
+        markup = self.params.get('reply_markup') or {}
+        return [b.get('callback_data') for row in markup.get('inline_keyboard', []) for b in row]
+
+
+class FakeBotAPI:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency #seconds added to every response
+        self.calls = []
+        self.webhook = None
+        self._server = None
+        self._updates = asyncio.Queue()
+        self._update_id = 0
+        self._message_ids = defaultdict(int)
+        self._chat_calls = defaultdict(asyncio.Queue) #chat_id -> calls made into that chat
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    #feeding the bot ########################################################################
+
+    def next_update_id(self):
+        self._update_id += 1
+        return self._update_id
+
+    def next_message_id(self, chat_id):
+        self._message_ids[chat_id] += 1
+        return self._message_ids[chat_id]
+
+    def queue_update(self, update):
+        self._updates.put_nowait(update)
+
+    async def next_call(self, chat_id, timeout=10):
+        return await asyncio.wait_for(self._chat_calls[chat_id].get(), timeout)
+
+    #http ###################################################################################
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                path = request_line.split(' ')[1]
+                status, payload = await self._dispatch(path, headers, body)
+                data = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass #client went away, or we are shutting down
+        finally:
+            writer.close()
+
+    def _params(self, headers, body):
+        content_type = headers.get('content-type', '')
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        params = {}
+        if content_type.startswith('multipart/form-data'):
+            #file uploads, files come back as {'filename': ..., 'content': bytes}
+            form = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            for part in form.iter_parts():
+                name, filename = part.get_param('name', header='content-disposition'), part.get_filename()
+                value = part.get_payload(decode=True)
+                if filename:
+                    params[name] = {'filename': filename, 'content': value}
+                else:
+                    value = value.decode()
+                    params[name] = json.loads(value) if name in JSON_FIELDS else value
+            return params
+        for name, value in parse_qsl(body.decode()):
+            params[name] = json.loads(value) if name in JSON_FIELDS else value
+        return params
+
+    async def _dispatch(self, path, headers, body):
+        method = path.rsplit('/', 1)[-1]
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return "404 Not Found", {'ok': False, 'error_code': 404, 'description': f"Not Found: {method}"}
+
+        call = Call(method, self._params(headers, body))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        call.result = await handler(call.params)
+        self.calls.append(call)
+        if call.chat_id is not None:
+            self._chat_calls[call.chat_id].put_nowait(call)
+        return "200 OK", {'ok': True, 'result': call.result}
+
+    #bot api methods ########################################################################
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_setWebhook(self, params):
+        self.webhook = params
+        return True
+
+    async def api_deleteWebhook(self, params):
+        self.webhook = None
+        return True
+
+    async def api_getUpdates(self, params):
+        try:
+            first = await asyncio.wait_for(self._updates.get(), float(params.get('timeout') or 0) or 0.01)
+        except asyncio.TimeoutError:
+            return []
+        updates = [first]
+        while not self._updates.empty() and len(updates) < int(params.get('limit') or 100):
+            updates.append(self._updates.get_nowait())
+        return updates
+
+    def _message(self, params, message_id=None):
+        chat_id = params['chat_id']
+        message = {
+            'message_id': message_id or self.next_message_id(chat_id),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+        if params.get('reply_markup'):
+            message['reply_markup'] = params['reply_markup']
+        return message
+
+    async def api_sendMessage(self, params):
+        return self._message(params)
+
+    async def api_editMessageText(self, params):
+        return self._message(params, message_id=params['message_id'])
+
+    async def api_sendDocument(self, params):
+        message = self._message(params)
+        document = params.get('document') or {}
+        message['document'] = {'file_id': f"doc{message['message_id']}", 'file_unique_id': f"doc{message['message_id']}",
+                               'file_name': document.get('filename'), 'file_size': len(document.get('content', b''))}
+        message['caption'] = params.get('caption')
+        return message
+
+    async def api_answerCallbackQuery(self, params):
+        return True
+
+
+#payload builders, shaped like what telegram sends #########################################
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Customer{user_id}', 'username': f'customer{user_id}'}
+
+def message_update(api, user_id, text):
+    update = {
+        'update_id': api.next_update_id(),
+        'message': {
+            'message_id': api.next_message_id(user_id),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user(user_id),
+            'text': text,
+        },
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return update
+
+def callback_update(api, user_id, message, data):
+    #message is the bot's message (a Call result) the button was on
+    return {
+        'update_id': api.next_update_id(),
+        'callback_query': {
+            'id': str(api.next_update_id()),
+            'from': user(user_id),
+            'chat_instance': str(user_id),
+            'message': message,
+            'data': data,
+        },
+    }
@@ -0,0 +1,197 @@
+"""Drop-time load test: the real Application and conv_handler against a fake Bot API.
+
+    python -m bench.load --customers 200 --admins 1
+
+N simulated customers go /start -> acai -> granola -> drizzle -> skip request
+-> cart -> checkout, pressing the buttons the bot actually sent them, while
+the admins keep /queue open and tap serve. Reports throughput and p50/p95/p99
+latency per handler, measured from the update reaching the bot's update
+source to the bot's reply arriving at the fake API.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from bench.fake_bot_api import FakeBotAPI, callback_update, message_update
+
+REPLY_METHODS = ('sendMessage', 'editMessageText')
+
+
+class Harness:
+    def __init__(self, api, app, args):
+        self.api = api
+        self.app = app
+        self.args = args
+        self.latencies = defaultdict(list) #handler name -> seconds
+        self.timeouts = defaultdict(int)
+        self.customers_done = 0
+        self.http = None
+
+    async def send(self, update):
+        if self.args.mode == 'webhook':
+            response = await self.http.post('/hook', json=update, headers={'X-Telegram-Bot-Api-Secret-Token': 'load'})
+            assert response.status_code == 200
+        else:
+            self.api.queue_update(update)
+
+    async def step(self, name, chat_id, update, accept):
+        #send an update and wait for the bot's reply that `accept` recognises
+        start = time.perf_counter()
+        await self.send(update)
+        deadline = start + self.args.timeout
+        while True:
+            try:
+                call = await self.api.next_call(chat_id, timeout=max(0.001, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                self.timeouts[name] += 1
+                return None
+            if call.method in REPLY_METHODS and accept(call):
+                self.latencies[name].append(call.at - start)
+                return call
+
+    #customers ##############################################################################
+
+    async def customer(self, user_id):
+        api = self.api
+        await asyncio.sleep(random.uniform(0, self.args.ramp))
+
+        def edit_of(message):
+            return lambda call: call.method == 'editMessageText' and call.params['message_id'] == message['message_id']
+
+        reply = await self.step('start_command', user_id, message_update(api, user_id, '/start'),
+                                lambda call: call.method == 'sendMessage')
+        if reply is None:
+            return
+        message = reply.result
+
+        #press the buttons we were given, like a person would
+        flow = [
+            ('handle_menu_selection', lambda buttons: buttons[0]),
+            ('handle_granola', lambda buttons: buttons[0]),
+            ('handle_drizzle', lambda buttons: random.choice(buttons)),
+            ('handle_special_request_skip', lambda buttons: buttons[0]),
+            ('handle_cart', lambda buttons: next(b for b in buttons if 'cart' in b)),
+            ('handle_checkout', lambda buttons: next(b for b in buttons if b.startswith('checkout'))),
+        ]
+        buttons = reply.buttons()
+        for name, choose in flow:
+            await asyncio.sleep(self.args.think)
+            reply = await self.step(name, user_id, callback_update(api, user_id, message, choose(buttons)), edit_of(message))
+            if reply is None:
+                return
+            buttons = reply.buttons()
+        self.customers_done += 1
+
+    #admins #################################################################################
+
+    async def admin(self, admin_id, customers_finished):
+        api = self.api
+        is_queue = lambda call: call.method == 'sendMessage' and call.params['text'].startswith(('📋', '✅ The queue'))
+        while True:
+            reply = await self.step('queue_command', admin_id, message_update(api, admin_id, '/queue'), is_queue)
+            if reply is None or not reply.buttons():
+                if customers_finished.done() and not len(self.app_db().pending):
+                    return
+                await asyncio.sleep(0.2)
+                continue
+
+            message = reply.result
+            edit_of = lambda call: call.method == 'editMessageText' and call.params['message_id'] == message['message_id']
+            while True:
+                serve = [b for b in reply.buttons() if b.startswith('serve_')]
+                if not serve:
+                    break
+                await asyncio.sleep(self.args.serve_every)
+                reply = await self.step('handle_queue_action', admin_id,
+                                        callback_update(api, admin_id, message, serve[0]), edit_of)
+                if reply is None: #another admin served it first, the page didnt change
+                    break
+                message = reply.result
+
+    def app_db(self):
+        return self.app.bot_data['shop'].db
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def report(harness, elapsed):
+    args = harness.args
+    updates = sum(len(v) for v in harness.latencies.values())
+    print(f"\n{args.customers} customers, {args.admins} admins, mode={args.mode}, "
+          f"api latency {args.api_latency * 1000:.0f}ms")
+    print(f"{harness.customers_done} checkouts in {elapsed:.2f}s = {harness.customers_done / elapsed:.1f} checkouts/s, "
+          f"{updates / elapsed:.1f} updates/s\n")
+    print(f"{'handler':<30}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'timeouts':>10}")
+    for name, values in harness.latencies.items():
+        ms = [v * 1000 for v in values]
+        print(f"{name:<30}{len(ms):>7}{_pct(ms, 50):>10.1f}{_pct(ms, 95):>10.1f}{_pct(ms, 99):>10.1f}"
+              f"{max(ms):>10.1f}{harness.timeouts[name]:>10}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--admins', type=int, default=1)
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--ramp', type=float, default=2.0, help='customers arrive spread over this many seconds')
+    parser.add_argument('--think', type=float, default=0.05, help='seconds a customer waits between taps')
+    parser.add_argument('--serve-every', type=float, default=0.02, help='seconds between an admin\'s serve taps')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds the fake api takes per call')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--update-concurrency', type=int, default=None)
+    args = parser.parse_args()
+
+    api = await FakeBotAPI(latency=args.api_latency).start()
+    tmp = tempfile.mkdtemp()
+    admin_ids = list(range(1, args.admins + 1))
+    os.environ.update({
+        'TELEGRAM_TOKEN': '123456:load',
+        'TELEGRAM_API_URL': api.url,
+        'DB_PATH': os.path.join(tmp, 'load.db'),
+        'ADMIN_IDS': ','.join(map(str, admin_ids)),
+    })
+    if args.update_concurrency is not None:
+        os.environ['UPDATE_CONCURRENCY'] = str(args.update_concurrency)
+    import main as bot
+
+    shop = bot.shops[0]
+    shop.db.init()
+    app = bot.build_app(shop)
+    harness = Harness(api, app, args)
+
+    async with app:
+        if args.mode == 'webhook':
+            import httpx
+            await app.updater.start_webhook(listen='127.0.0.1', port=18444, url_path='hook', secret_token='load',
+                                            webhook_url='http://127.0.0.1:18444/hook')
+            harness.http = httpx.AsyncClient(base_url='http://127.0.0.1:18444', limits=httpx.Limits(max_connections=200))
+        else:
+            await app.updater.start_polling(poll_interval=0, timeout=1)
+        await app.start()
+        await bot.startup(app)
+
+        start = time.perf_counter()
+        customers = asyncio.gather(*(harness.customer(10_000 + n) for n in range(args.customers)))
+        admins = asyncio.gather(*(harness.admin(a, customers) for a in admin_ids))
+        await customers
+        await admins
+        elapsed = time.perf_counter() - start
+
+        if harness.http:
+            await harness.http.aclose()
+        await app.updater.stop()
+        await app.stop()
+    await bot.shutdown(app)
+    await api.stop()
+    report(harness, elapsed)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""Run main.py's app in webhook mode against the fake Bot API and post it an update.
+
+    python -m bench.webhook_smoke
+
+Checks that a /start posted with the right secret token gets a reply, that a
+wrong secret is rejected, and that a burst of taps from one user is handled
+in order while other users' updates run concurrently. Fails with an
+AssertionError if any of that doesn't hold.
+"""
+import asyncio
+import os
+import tempfile
+
+import httpx
+
+from bench.fake_bot_api import FakeBotAPI, callback_update, message_update
+
+SECRET = 'smoke-secret'
+
+
+async def main():
+    api = await FakeBotAPI().start()
+    tmp = tempfile.mkdtemp()
+    os.environ.update({
+        'TELEGRAM_TOKEN': '123456:fake',
+        'TELEGRAM_API_URL': api.url,
+        'DB_PATH': os.path.join(tmp, 'smoke.db'),
+        'ADMIN_IDS': '1',
+    })
+    import main as bot
+
+    shop = bot.shops[0]
+    shop.db.init()
+    app = bot.build_app(shop)
+    port = 18443
+    async with app:
+        await app.updater.start_webhook(
+            listen='127.0.0.1', port=port, url_path='hook', secret_token=SECRET,
+            webhook_url=f'http://127.0.0.1:{port}/hook')
+        await app.start()
+        await bot.startup(app) #post_init only runs under run_webhook/run_polling
+        assert api.webhook['url'] == f'http://127.0.0.1:{port}/hook', api.webhook
+        print('webhook registered:', api.webhook['url'])
+
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}') as client:
+            bad = await client.post('/hook', json=message_update(api, 50, '/start'),
+                                    headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+            assert bad.status_code == 403, bad.status_code
+            print('wrong secret ->', bad.status_code)
+
+            async def post(update):
+                response = await client.post('/hook', json=update, headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+                assert response.status_code == 200, response.status_code
+
+            #ten users start at once
+            users = range(100, 110)
+            await asyncio.gather(*(post(message_update(api, u, '/start')) for u in users))
+            menus = {u: (await api.next_call(u)).result for u in users}
+            assert len(menus) == len(users) and all(m.get('reply_markup') for m in menus.values()), menus
+            print('replies to /start:', len(menus))
+
+            #one user double-taps through the menu faster than we answer, state must still line up
+            u = users[0]
+            for data in ('menu_acai', 'granola_matcha', 'drizzle_honey', 'skip_request'):
+                await post(callback_update(api, u, menus[u], data))
+            texts = []
+            while len(texts) < 4:
+                call = await api.next_call(u)
+                if call.method == 'editMessageText':
+                    texts.append(call.params['text'].splitlines()[0])
+            expected = ['Customizing **Classic Acai Bowl**', 'Now choose your Drizzle!',
+                        '📝 **Any special requests/messages for Melvin?**',
+                        '✅ Added **Classic Acai Bowl (Matcha, Honey Drizzle)** to cart!']
+            assert texts == expected, texts
+            print('one user, in order:', texts)
+
+        await app.updater.stop()
+        await app.stop()
+    await bot.shutdown(app) #after the app's own shutdown, which flushes persistence
+    await api.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
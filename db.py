@@ -0,0 +1,911 @@
+import asyncio
+import bisect
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+#applied to every connection we open
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",    #readers dont block the writer (and vice versa)
+    "PRAGMA synchronous=FULL",    #commits are batched, so we can afford an fsync per commit
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",    #8MB page cache per connection
+)
+
+
+def _create_schema(conn):
+    #orders table
+    conn.execute('''CREATE TABLE IF NOT EXISTS orders (
+                    id TEXT PRIMARY KEY,
+                    customer_id INTEGER,
+                    customer_name TEXT,
+                    items TEXT,
+                    total REAL,
+                    status TEXT)''')
+    #settings table
+    conn.execute('''CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT)''')
+
+    #default shop status
+    conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('shop_open', '1')")
+
+def _add_order_created_at(conn):
+    conn.execute("ALTER TABLE orders ADD COLUMN created_at REAL")
+    #older orders have no timestamp, date them just before now, a microsecond apart in rowid order
+    #so they stay in insertion order and ahead of new ones
+    conn.execute("""UPDATE orders SET created_at = ? - ((SELECT MAX(rowid) FROM orders) - rowid) * 0.000001
+                    WHERE created_at IS NULL""", (time.time(),))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)")
+
+def _create_outbox(conn):
+    #messages waiting to go out, rows are deleted once telegram accepts them
+    conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    parse_mode TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id)")
+
+def _create_persistence_tables(conn):
+    #bot persistence (see persistence.py), one row per user per user_data key
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_data (
+                    user_id INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, key)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS conversations (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (name, key)) WITHOUT ROWID''')
+
+def _add_order_numbers(conn):
+    #one order per checkout button, however many times it gets tapped
+    conn.execute("ALTER TABLE orders ADD COLUMN checkout_key TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_checkout_key ON orders (checkout_key)")
+    #order numbers come from a counter, started past any all-digit id the old uuid scheme produced
+    conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("""INSERT OR IGNORE INTO counters (name, value)
+                    SELECT 'order_no', COALESCE(MAX(CAST(id AS INTEGER)), 0) FROM orders
+                    WHERE id != '' AND id NOT GLOB '*[^0-9]*'""")
+
+def _create_order_items(conn):
+    #one row per bowl, status mirrors the order's so prep counts are a single index range scan
+    conn.execute('''CREATE TABLE IF NOT EXISTS order_items (
+                    order_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    price REAL NOT NULL,
+                    item TEXT NOT NULL,
+                    granola TEXT,
+                    drizzle TEXT,
+                    request TEXT,
+                    status TEXT NOT NULL,
+                    PRIMARY KEY (order_id, position)) WITHOUT ROWID''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_order_items_prep
+                    ON order_items (status, item, granola, drizzle)''')
+    for row in conn.execute("SELECT id, items, status FROM orders").fetchall():
+        _insert_order_items(conn, row['id'], json.loads(row['items'] or '[]'), row['status'])
+
+def _create_stock(conn):
+    #stock per menu component, e.g. ('granola', 'matcha'); components without a row are unlimited
+    conn.execute('''CREATE TABLE IF NOT EXISTS stock (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    quantity INTEGER NOT NULL CHECK (quantity >= 0),
+                    PRIMARY KEY (kind, key)) WITHOUT ROWID''')
+
+def _create_waitlist(conn):
+    #customers turned away at capacity, served first come first served
+    conn.execute('''CREATE TABLE IF NOT EXISTS waitlist (
+                    user_id INTEGER PRIMARY KEY,
+                    chat_id INTEGER NOT NULL,
+                    joined_at REAL NOT NULL)''')
+
+def _create_archive(conn):
+    #served orders are moved here in batches (see archive.py) so the live tables only hold recent ones
+    conn.execute("ALTER TABLE orders ADD COLUMN served_at REAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS orders_archive (
+                    id TEXT PRIMARY KEY,
+                    customer_id INTEGER,
+                    customer_name TEXT,
+                    items TEXT,
+                    total REAL,
+                    status TEXT,
+                    created_at REAL,
+                    checkout_key TEXT,
+                    served_at REAL)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_checkout_key ON orders_archive (checkout_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_created ON orders_archive (created_at)")
+    conn.execute('''CREATE TABLE IF NOT EXISTS order_items_archive (
+                    order_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    price REAL NOT NULL,
+                    item TEXT NOT NULL,
+                    granola TEXT,
+                    drizzle TEXT,
+                    request TEXT,
+                    status TEXT NOT NULL,
+                    PRIMARY KEY (order_id, position)) WITHOUT ROWID''')
+    #sales rollups, bumped in the same transaction that serves the orders
+    conn.execute('''CREATE TABLE IF NOT EXISTS sales_daily (
+                    day TEXT PRIMARY KEY,
+                    orders INTEGER NOT NULL,
+                    bowls INTEGER NOT NULL,
+                    revenue REAL NOT NULL)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sales_components (
+                    day TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    revenue REAL NOT NULL,
+                    PRIMARY KEY (day, kind, key)) WITHOUT ROWID''')
+    #orders served before this have no served_at, they are counted on the day they were placed
+    served = conn.execute("SELECT id, created_at FROM orders WHERE status='served'").fetchall()
+    by_day = {}
+    for row in served:
+        by_day.setdefault(_day(row['created_at']), []).append(row['id'])
+    for day, ids in by_day.items():
+        for i in range(0, len(ids), 500):
+            _add_sales(conn, day, ids[i:i + 500])
+
+def _add_orders_created_index(conn):
+    #exports of every status walk orders by created_at, (status, created_at) can't give that order
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)")
+
+#schema upgrades, applied in order and tracked with PRAGMA user_version
+MIGRATIONS = [
+    _create_schema,
+    _add_order_created_at,
+    _create_outbox,
+    _create_persistence_tables,
+    _add_order_numbers,
+    _create_order_items,
+    _create_stock,
+    _create_waitlist,
+    _create_archive,
+    _add_orders_created_index,
+]
+
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, step in enumerate(MIGRATIONS, start=1):
+        if version < target:
+            step(conn)
+            conn.execute(f"PRAGMA user_version={target}")
+
+
+def split_item_name(name):
+    #'Classic Acai Bowl (Matcha, Honey Drizzle)' -> ('Classic Acai Bowl', 'Matcha', 'Honey'),
+    #for cart items saved before they carried their parts separately
+    base, _, rest = name.partition(' (')
+    granola, _, drizzle = rest.rstrip(')').partition(', ')
+    return base, granola or None, drizzle.removesuffix(' Drizzle') or None
+
+def _item_row(order_id, position, item, status):
+    if 'item' in item:
+        parts = (item['item'], item.get('granola'), item.get('drizzle'))
+    else:
+        parts = split_item_name(item['name'])
+    return (order_id, position, item['name'], item['price'], *parts, item.get('request'), status)
+
+def _row_to_item(row):
+    item = {'name': row['name'], 'price': row['price'], 'request': row['request'], 'item': row['item']}
+    if row['granola'] is not None:
+        item['granola'] = row['granola']
+        item['drizzle'] = row['drizzle']
+    return item
+
+def _row_to_order(row, items):
+    return {
+        'id': row['id'],
+        'customer_id': row['customer_id'],
+        'customer_name': row['customer_name'],
+        'items': items,
+        'total': row['total'],
+        'created_at': row['created_at'],
+        'checkout_key': row['checkout_key'],
+    }
+
+
+def _select_settings(conn):
+    return {row['key']: row['value'] for row in conn.execute("SELECT key, value FROM settings")}
+
+def _upsert_setting(conn, key, value):
+    conn.execute("""INSERT INTO settings (key, value) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value=excluded.value""", (key, value))
+
+def _insert_order_items(conn, order_id, items, status):
+    conn.executemany("""INSERT OR IGNORE INTO order_items
+                        (order_id, position, name, price, item, granola, drizzle, request, status)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                     [_item_row(order_id, position, item, status) for position, item in enumerate(items)])
+
+def _insert_order(conn, order):
+    #items also kept as a json string, but order_items is what gets read back
+    conn.execute("""INSERT INTO orders (id, customer_id, customer_name, items, total, status, created_at, checkout_key)
+                    VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)""",
+                 (order['id'], order['customer_id'], order['customer_name'],
+                  json.dumps(order['items']), order['total'], order['created_at'], order['checkout_key']))
+    _insert_order_items(conn, order['id'], order['items'], 'pending')
+    if order['id'].isdigit():
+        conn.execute("UPDATE counters SET value=MAX(value, ?) WHERE name='order_no'", (int(order['id']),))
+
+def _select_counter(conn, name):
+    row = conn.execute("SELECT value FROM counters WHERE name=?", (name,)).fetchone()
+    return row[0] if row else 0
+
+ORDER_COLUMNS = "id, customer_id, customer_name, total, created_at, checkout_key"
+
+def _select_items(conn, order_id, table='order_items'):
+    rows = conn.execute(f"SELECT * FROM {table} WHERE order_id=? ORDER BY position", (order_id,))
+    return [_row_to_item(r) for r in rows]
+
+def _select_pending_orders(conn):
+    items = {}
+    for row in conn.execute("SELECT * FROM order_items WHERE status='pending' ORDER BY order_id, position"):
+        items.setdefault(row['order_id'], []).append(_row_to_item(row))
+    rows = conn.execute(
+        f"SELECT {ORDER_COLUMNS} FROM orders WHERE status='pending' ORDER BY created_at, id").fetchall()
+    return [_row_to_order(r, items.get(r['id'], [])) for r in rows]
+
+def _select_order_where(conn, where, value):
+    #live orders first, then the archive
+    for orders, items in (('orders', 'order_items'), ('orders_archive', 'order_items_archive')):
+        row = conn.execute(f"SELECT {ORDER_COLUMNS} FROM {orders} WHERE {where}=?", (value,)).fetchone()
+        if row:
+            return _row_to_order(row, _select_items(conn, row['id'], items))
+    return None
+
+def _select_order(conn, order_id):
+    return _select_order_where(conn, 'id', order_id)
+
+def _select_order_by_checkout_key(conn, checkout_key):
+    #archived keys count too, a tap on an old confirmation must not order again
+    return _select_order_where(conn, 'checkout_key', checkout_key)
+
+def _day(timestamp):
+    return time.strftime('%Y-%m-%d', time.localtime(timestamp))
+
+def _add_sales(conn, day, order_ids):
+    #adds the orders to the day's rollups, they must still be in the live tables
+    marks = ','.join('?' * len(order_ids))
+    conn.execute(f"""INSERT INTO sales_daily (day, orders, bowls, revenue)
+                     SELECT ?, COUNT(*), (SELECT COUNT(*) FROM order_items WHERE order_id IN ({marks})), TOTAL(total)
+                     FROM orders WHERE id IN ({marks})
+                     ON CONFLICT(day) DO UPDATE SET orders=orders+excluded.orders,
+                        bowls=bowls+excluded.bowls, revenue=revenue+excluded.revenue""",
+                 (day, *order_ids, *order_ids))
+    for kind in ('item', 'granola', 'drizzle'):
+        #toppings have no price of their own, only bowls carry revenue
+        revenue = 'TOTAL(price)' if kind == 'item' else '0'
+        conn.execute(f"""INSERT INTO sales_components (day, kind, key, count, revenue)
+                         SELECT ?, ?, {kind}, COUNT(*), {revenue} FROM order_items
+                         WHERE order_id IN ({marks}) AND {kind} IS NOT NULL GROUP BY {kind}
+                         ON CONFLICT(day, kind, key) DO UPDATE SET count=count+excluded.count,
+                            revenue=revenue+excluded.revenue""",
+                     (day, kind, *order_ids))
+
+def _update_orders_served(conn, order_ids):
+    #returns the ids that were still pending, anything another admin got to first is left alone
+    now = time.time()
+    marks = ','.join('?' * len(order_ids))
+    served = [row[0] for row in conn.execute(
+        f"UPDATE orders SET status='served', served_at=? WHERE status='pending' AND id IN ({marks}) RETURNING id",
+        (now, *order_ids))]
+    if served:
+        marks = ','.join('?' * len(served))
+        conn.execute(f"UPDATE order_items SET status='served' WHERE order_id IN ({marks})", served)
+        _add_sales(conn, _day(now), served)
+    return served
+
+def _archive_served(conn, before, limit):
+    #moves up to limit orders served before `before` to the archive tables, returns how many
+    ids = [row[0] for row in conn.execute(
+        "SELECT id FROM orders WHERE status='served' AND COALESCE(served_at, created_at) < ? LIMIT ?", (before, limit))]
+    if ids:
+        marks = ','.join('?' * len(ids))
+        conn.execute(f"""INSERT OR IGNORE INTO orders_archive
+                         (id, customer_id, customer_name, items, total, status, created_at, checkout_key, served_at)
+                         SELECT id, customer_id, customer_name, items, total, status, created_at, checkout_key, served_at
+                         FROM orders WHERE id IN ({marks})""", ids)
+        conn.execute(f"""INSERT OR IGNORE INTO order_items_archive
+                         (order_id, position, name, price, item, granola, drizzle, request, status)
+                         SELECT order_id, position, name, price, item, granola, drizzle, request, status
+                         FROM order_items WHERE order_id IN ({marks})""", ids)
+        conn.execute(f"DELETE FROM order_items WHERE order_id IN ({marks})", ids)
+        conn.execute(f"DELETE FROM orders WHERE id IN ({marks})", ids)
+    return len(ids)
+
+def _select_sales(conn, since_day):
+    #(daily rows, {kind: [component rows, best sellers first]}) from the rollups alone
+    days = [dict(r) for r in conn.execute(
+        "SELECT day, orders, bowls, revenue FROM sales_daily WHERE day >= ? ORDER BY day", (since_day,))]
+    components = {}
+    for row in conn.execute("""SELECT kind, key, SUM(count) AS count, SUM(revenue) AS revenue
+                               FROM sales_components WHERE day >= ?
+                               GROUP BY kind, key ORDER BY count DESC, key""", (since_day,)):
+        components.setdefault(row['kind'], []).append(dict(row))
+    return days, components
+
+def _select_prep_counts(conn):
+    #answered from idx_order_items_prep alone
+    rows = conn.execute("""SELECT item, granola, drizzle, COUNT(*) AS count FROM order_items
+                           WHERE status='pending' GROUP BY item, granola, drizzle""").fetchall()
+    return [dict(r) for r in rows]
+
+def _insert_outbox(conn, messages):
+    rows = []
+    now = time.time()
+    for message in messages:
+        cur = conn.execute("INSERT INTO outbox (chat_id, text, parse_mode, next_attempt_at) VALUES (?, ?, ?, ?)",
+                           (message['chat_id'], message['text'], message.get('parse_mode'), now))
+        rows.append(dict(message, id=cur.lastrowid, attempts=0))
+    return rows
+
+def _select_stock(conn):
+    return {(row['kind'], row['key']): row['quantity'] for row in conn.execute("SELECT kind, key, quantity FROM stock")}
+
+def _upsert_stock(conn, kind, key, quantity):
+    if quantity is None:
+        conn.execute("DELETE FROM stock WHERE kind=? AND key=?", (kind, key))
+    else:
+        conn.execute("""INSERT INTO stock (kind, key, quantity) VALUES (?, ?, ?)
+                        ON CONFLICT(kind, key) DO UPDATE SET quantity=excluded.quantity""", (kind, key, quantity))
+
+def _reserve_stock(conn, needed):
+    #needed is {(kind, key): count}, returns what is left of every tracked component touched
+    left = {}
+    for (kind, key), count in needed.items():
+        row = conn.execute("""UPDATE stock SET quantity = quantity - ?
+                              WHERE kind=? AND key=? AND quantity >= ? RETURNING quantity""",
+                           (count, kind, key, count)).fetchone()
+        if row is not None:
+            left[(kind, key)] = row[0]
+        elif conn.execute("SELECT 1 FROM stock WHERE kind=? AND key=?", (kind, key)).fetchone():
+            raise SoldOut(kind, key) #the savepoint rolls back whatever was reserved before this
+    return left
+
+def _insert_order_and_outbox(conn, order, messages, needed):
+    left = _reserve_stock(conn, needed)
+    _insert_order(conn, order)
+    return left, _insert_outbox(conn, messages)
+
+def _update_orders_served_and_outbox(conn, orders, notify):
+    #notify(served orders) -> messages, so nobody hears twice about an order served twice
+    served_ids = _update_orders_served(conn, [o['id'] for o in orders])
+    served = [o for o in orders if o['id'] in served_ids]
+    return served, _insert_outbox(conn, notify(served) if served else [])
+
+def _count_orders_since(conn, since):
+    return sum(conn.execute(f"SELECT COUNT(*) FROM {table} WHERE created_at >= ?", (since,)).fetchone()[0]
+               for table in ('orders', 'orders_archive'))
+
+def _select_waitlist(conn):
+    return [dict(r) for r in conn.execute("SELECT user_id, chat_id, joined_at FROM waitlist ORDER BY joined_at, user_id")]
+
+def _insert_waitlist(conn, user_id, chat_id, joined_at):
+    conn.execute("INSERT OR IGNORE INTO waitlist (user_id, chat_id, joined_at) VALUES (?, ?, ?)", (user_id, chat_id, joined_at))
+
+def _delete_waitlist_and_outbox(conn, user_ids, messages):
+    conn.executemany("DELETE FROM waitlist WHERE user_id=?", [(user_id,) for user_id in user_ids])
+    return _insert_outbox(conn, messages)
+
+def _select_queued_outbox(conn):
+    rows = conn.execute("""SELECT id, chat_id, text, parse_mode, attempts, next_attempt_at
+                           FROM outbox WHERE status='queued' ORDER BY id""").fetchall()
+    return [dict(r) for r in rows]
+
+def _delete_outbox(conn, row_id):
+    conn.execute("DELETE FROM outbox WHERE id=?", (row_id,))
+
+def _update_outbox_retry(conn, row_id, attempts, next_attempt_at, error):
+    conn.execute("UPDATE outbox SET attempts=?, next_attempt_at=?, last_error=? WHERE id=?",
+                 (attempts, next_attempt_at, error, row_id))
+
+def _update_outbox_failed(conn, row_id, attempts, error):
+    conn.execute("UPDATE outbox SET status='failed', attempts=?, last_error=? WHERE id=?",
+                 (attempts, error, row_id))
+
+
+class PendingOrders:
+    """In-memory mirror of the pending orders, oldest first.
+
+    Loaded once at startup and then kept in sync by Database.add_order and
+    Database.mark_orders_served after their writes commit, so queue views never
+    have to rescan the orders table.
+    """
+
+    def __init__(self):
+        self._orders = {}
+        self._keys = [] #sorted (created_at, id)
+        self._by_checkout_key = {}
+        self._by_customer = {} #customer_id -> {order_id: None}, in insert order
+        self._positions = {} #order_id -> 1-based place, rebuilt lazily
+        self._positions_version = -1
+        self.version = 0 #bumped on every change
+        self.listener = None #called after every change, see LiveQueue
+
+    def _changed(self):
+        self.version += 1
+        if self.listener:
+            self.listener()
+
+    def _index_customer(self, order):
+        self._by_customer.setdefault(order['customer_id'], {})[order['id']] = None
+
+    def _unindex_customer(self, order):
+        ids = self._by_customer.get(order['customer_id'])
+        if ids is not None:
+            ids.pop(order['id'], None)
+            if not ids:
+                del self._by_customer[order['customer_id']]
+
+    def load(self, orders):
+        self._orders = {o['id']: o for o in orders}
+        self._by_checkout_key = {o['checkout_key']: o for o in orders if o.get('checkout_key')}
+        self._keys = sorted((o['created_at'], o['id']) for o in orders)
+        self._by_customer = {}
+        for _, order_id in self._keys:
+            self._index_customer(self._orders[order_id])
+        self._changed()
+
+    def add(self, order):
+        key = (order['created_at'], order['id'])
+        if not self._keys or key > self._keys[-1]:
+            self._keys.append(key) #the usual case
+        else:
+            bisect.insort(self._keys, key)
+        self._orders[order['id']] = order
+        if order.get('checkout_key'):
+            self._by_checkout_key[order['checkout_key']] = order
+        self._index_customer(order)
+        self._changed()
+
+    def remove(self, order_id):
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return None
+        key = (order['created_at'], order_id)
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        self._by_checkout_key.pop(order.get('checkout_key'), None)
+        self._unindex_customer(order)
+        self._changed()
+        return order
+
+    def remove_many(self, order_ids):
+        #one version bump for a whole batch, so views re-render once
+        removed = [o for o in (self._orders.pop(i, None) for i in order_ids) if o]
+        if removed:
+            gone = {(o['created_at'], o['id']) for o in removed}
+            self._keys = [key for key in self._keys if key not in gone]
+            for order in removed:
+                self._by_checkout_key.pop(order.get('checkout_key'), None)
+                self._unindex_customer(order)
+            self._changed()
+        return removed
+
+    def get(self, order_id):
+        return self._orders.get(order_id)
+
+    def get_by_checkout_key(self, checkout_key):
+        return self._by_checkout_key.get(checkout_key)
+
+    def orders(self):
+        return [self._orders[order_id] for _, order_id in self._keys]
+
+    #keyset pagination helpers, keys are (created_at, id)
+    def page_from(self, key, limit, after=False):
+        if key is None:
+            start = 0
+        else:
+            start = (bisect.bisect_right if after else bisect.bisect_left)(self._keys, key)
+        return [self._orders[order_id] for _, order_id in self._keys[start:start + limit]]
+
+    def page_before(self, key, limit):
+        end = bisect.bisect_left(self._keys, key)
+        return [self._orders[order_id] for _, order_id in self._keys[max(0, end - limit):end]]
+
+    def position(self, order):
+        #1-based place in the queue
+        return bisect.bisect_left(self._keys, (order['created_at'], order['id'])) + 1
+
+    def position_of(self, order_id):
+        #same as position() but a dict lookup, for /status; the index is rebuilt at most
+        #once per change, however many customers ask in between
+        if self._positions_version != self.version:
+            self._positions = {order_id: i for i, (_, order_id) in enumerate(self._keys, 1)}
+            self._positions_version = self.version
+        return self._positions.get(order_id)
+
+    def for_customer(self, customer_id):
+        return [self._orders[order_id] for order_id in self._by_customer.get(customer_id, ())]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class SoldOut(Exception):
+    def __init__(self, kind, key):
+        super().__init__(f"{kind} {key} is sold out")
+        self.kind = kind
+        self.key = key
+
+
+class SettingsCache:
+    """The settings table, held in memory.
+
+    Loaded in one go at startup and kept current by Database.set_setting,
+    which writes through to sqlite before updating the cached value.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self.hits = 0
+        self.db_reads = 0
+
+    def load(self, values):
+        self._values = dict(values)
+        self.db_reads += 1
+
+    def get(self, key, default=None):
+        self.hits += 1
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        self._values[key] = value
+
+    def summary(self):
+        return f"{self.hits} cache hits, {self.db_reads} db reads"
+
+
+class BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.writes = 0
+        self.max_batch = 0
+        self.commit_seconds = 0.0
+        self.max_commit_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, size, seconds):
+        with self._lock:
+            self.batches += 1
+            self.writes += size
+            self.max_batch = max(self.max_batch, size)
+            self.commit_seconds += seconds
+            self.max_commit_seconds = max(self.max_commit_seconds, seconds)
+
+    def summary(self):
+        if not self.batches:
+            return "no writes yet"
+        return (f"{self.writes} writes in {self.batches} commits "
+                f"(avg batch {self.writes / self.batches:.1f}, max {self.max_batch}), "
+                f"commit avg {self.commit_seconds / self.batches * 1000:.1f}ms "
+                f"max {self.max_commit_seconds * 1000:.1f}ms")
+
+
+class ServeTimes:
+    """Rolling average of how long each order takes to serve, for /status estimates.
+
+    Every served order adds the time since the one before it; a batch served
+    at once counts as one gap followed by zeros, so the average stays per
+    order. Gaps longer than `max_gap` (a break, the shop closing) are left out.
+    """
+
+    def __init__(self, window=20, max_gap=900):
+        self.max_gap = max_gap
+        self._gaps = deque(maxlen=window)
+        self._last = None
+
+    def record(self, count, now=None):
+        if count <= 0:
+            return
+        now = time.time() if now is None else now
+        if self._last is not None and now - self._last <= self.max_gap:
+            self._gaps.append(now - self._last)
+            self._gaps.extend([0.0] * (count - 1))
+        self._last = now
+
+    def average(self):
+        #seconds per order, None until there is something to go on
+        if len(self._gaps) < 2:
+            return None
+        return sum(self._gaps) / len(self._gaps)
+
+
+class Executors:
+    """The writer thread and reader pool, which several Databases can share.
+
+    Each Database keeps its own per-thread connections, so a shared thread
+    simply holds one connection per db file. Sharing the writer means writes
+    to different files take turns, which is what the disk does anyway.
+    """
+
+    def __init__(self, readers=4):
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self.readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+
+    def shutdown(self):
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+
+
+class Database:
+    """SQLite access that never runs on the event loop.
+
+    All writes go through one dedicated writer thread (sqlite only allows one
+    writer at a time anyway), reads are spread over a small pool of reader
+    threads. Each thread keeps its own long-lived connection.
+
+    Writes that arrive within `batch_window` seconds of each other are
+    committed together (up to `batch_max` per transaction), so a drop burst
+    costs one fsync per batch instead of one per order. Each write still
+    only resolves once the transaction it was part of has committed.
+
+    Pass `executors` to share the threads with other Databases (one per shop
+    in multi-shop mode); they are then left running on close().
+    """
+
+    def __init__(self, path='acai_bot.db', readers=4, batch_window=0.002, batch_max=200, executors=None):
+        self.path = path
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self.stats = BatchStats()
+        self.pending = PendingOrders()
+        self.serve_times = ServeTimes()
+        self.settings = SettingsCache()
+        self.stock = {} #(kind, key) -> quantity left, only for tracked components
+        self._owns_executors = executors is None
+        self._executors = executors or Executors(readers)
+        self._writer = self._executors.writer
+        self._readers = self._executors.readers
+        self._local = threading.local() #per db, so shared threads get one connection per file
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._write_queue = None
+        self._batcher = None
+        self._closed = False
+        self._last_order_no = 0
+        self.outbox_listener = None #called with freshly queued outbox rows once committed
+        self.stock_listener = None #called with {(kind, key): quantity} whenever stock changes
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            #autocommit mode, the writer manages its own transactions
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _run_read(self, fn, args):
+        return fn(self._conn(), *args)
+
+    def _run_batch(self, ops):
+        #one transaction for the whole batch, one savepoint per write so a
+        #failing write only rolls back itself
+        conn = self._conn()
+        start = time.perf_counter()
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args in ops:
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    results.append((True, fn(conn, *args)))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_op")
+                    results.append((False, e))
+                conn.execute("RELEASE write_op")
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            return [(False, e)] * len(ops)
+        self.stats.record(len(ops), time.perf_counter() - start)
+        return results
+
+    async def _batch_writes(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._write_queue.get()]
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window) #let the rest of the burst pile up
+            while len(batch) < self.batch_max and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+
+            try:
+                results = await loop.run_in_executor(
+                    self._writer, self._run_batch, [(fn, args) for fn, args, _ in batch])
+            except Exception as e: #e.g. the writer was shut down under us
+                results = [(False, e)] * len(batch)
+            for (_, _, fut), (ok, value) in zip(batch, results):
+                if fut.done(): #caller gave up waiting
+                    continue
+                if ok:
+                    fut.set_result(value)
+                else:
+                    fut.set_exception(value)
+
+    async def read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, fn, args)
+
+    async def write(self, fn, *args):
+        if self._closed:
+            raise RuntimeError("database is closed")
+        if self._batcher is None:
+            self._write_queue = asyncio.Queue()
+            self._batcher = asyncio.create_task(self._batch_writes())
+        fut = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((fn, args, fut))
+        return await fut
+
+    def init(self):
+        #called once before the bot starts, blocking is fine here
+        [(ok, value)] = self._writer.submit(self._run_batch, [(_migrate, ())]).result()
+        if not ok:
+            raise value
+        self.pending.load(self._readers.submit(self._run_read, _select_pending_orders, ()).result())
+        self.settings.load(self._readers.submit(self._run_read, _select_settings, ()).result())
+        self.stock = self._readers.submit(self._run_read, _select_stock, ()).result()
+        self._last_order_no = self._readers.submit(self._run_read, _select_counter, ('order_no',)).result()
+
+    def close(self):
+        self._closed = True
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+        if self._owns_executors:
+            self._executors.shutdown()
+        else:
+            self._writer.submit(lambda: None).result() #let writes already handed to the shared writer finish
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+
+    ###############################################################################################
+
+    def get_setting(self, key, default=None):
+        return self.settings.get(key, default)
+
+    async def set_setting(self, key, value):
+        #write-through, the cache only changes once the db has it
+        value = str(value)
+        await self.write(_upsert_setting, key, value)
+        self.settings.set(key, value)
+
+    async def reload_settings(self):
+        self.settings.load(await self.read(_select_settings))
+
+    def is_shop_open(self) -> bool:
+        return self.get_setting('shop_open', '1') == '1'
+
+    async def set_shop_open(self, is_open: bool):
+        await self.set_setting('shop_open', '1' if is_open else '0')
+
+    async def set_stock(self, kind, key, quantity):
+        #quantity None stops tracking the component
+        await self.write(_upsert_stock, kind, key, quantity)
+        if quantity is None:
+            self.stock.pop((kind, key), None)
+        else:
+            self.stock[(kind, key)] = quantity
+        self._stock_changed({(kind, key): quantity})
+
+    def _stock_changed(self, changes):
+        if changes and self.stock_listener:
+            self.stock_listener(changes)
+
+    def _queued(self, rows):
+        if rows and self.outbox_listener:
+            self.outbox_listener(rows)
+
+    def next_order_id(self):
+        #we are the only writer, so the in-memory counter is the source of truth and
+        #the db copy only has to catch up in the insert's transaction; numbers
+        #of failed inserts are simply skipped
+        self._last_order_no += 1
+        return str(self._last_order_no)
+
+    async def add_order(self, order_id, customer_id, customer_name, items, total, messages=(), checkout_key=None, needed=None):
+        #messages go into the outbox in the same transaction as the order, and the
+        #stock in needed ({(kind, key): count}) is taken there too; raises SoldOut if short
+        order = {
+            'id': order_id,
+            'customer_id': customer_id,
+            'customer_name': customer_name,
+            'items': items,
+            'total': total,
+            'created_at': time.time(),
+            'checkout_key': checkout_key,
+        }
+        needed = dict(needed or {})
+        left, rows = await self.write(_insert_order_and_outbox, order, list(messages), needed)
+        for component in left: #apply the same deltas, results of one batch can resume in any order
+            if component in self.stock:
+                self.stock[component] -= needed[component]
+        self.pending.add(order)
+        self._stock_changed({component: self.stock.get(component) for component in left})
+        self._queued(rows)
+        return order
+
+    async def get_order(self, order_id):
+        order = self.pending.get(order_id)
+        if order is None:
+            order = await self.read(_select_order, order_id)
+        return order
+
+    async def get_order_by_checkout_key(self, checkout_key):
+        order = self.pending.get_by_checkout_key(checkout_key)
+        if order is None:
+            order = await self.read(_select_order_by_checkout_key, checkout_key)
+        return order
+
+    async def get_prep_counts(self):
+        #pending bowls per (item, granola, drizzle)
+        return await self.read(_select_prep_counts)
+
+    async def mark_orders_served(self, orders, notify=lambda served: []):
+        #one UPDATE for the whole batch, returns the orders that were actually still pending
+        if not orders:
+            return []
+        served, rows = await self.write(_update_orders_served_and_outbox, list(orders), notify)
+        self.pending.remove_many(o['id'] for o in served)
+        self.serve_times.record(len(served))
+        self._queued(rows)
+        return served
+
+    async def archive_served(self, before, limit=500):
+        return await self.write(_archive_served, before, limit)
+
+    async def get_sales(self, since_day):
+        return await self.read(_select_sales, since_day)
+
+    async def count_orders_since(self, since):
+        return await self.read(_count_orders_since, since)
+
+    async def get_waitlist(self):
+        return await self.read(_select_waitlist)
+
+    async def join_waitlist(self, user_id, chat_id, joined_at):
+        await self.write(_insert_waitlist, user_id, chat_id, joined_at)
+
+    async def leave_waitlist(self, user_ids, messages=()):
+        #messages (e.g. "your turn") are queued in the same transaction
+        rows = await self.write(_delete_waitlist_and_outbox, list(user_ids), list(messages))
+        self._queued(rows)
+
+    async def queue_messages(self, messages):
+        rows = await self.write(_insert_outbox, list(messages))
+        self._queued(rows)
+
+    async def get_queued_messages(self):
+        return await self.read(_select_queued_outbox)
+
+    async def message_sent(self, row_id):
+        await self.write(_delete_outbox, row_id)
+
+    async def message_retry(self, row_id, attempts, next_attempt_at, error):
+        await self.write(_update_outbox_retry, row_id, attempts, next_attempt_at, error)
+
+    async def message_failed(self, row_id, attempts, error):
+        await self.write(_update_outbox_failed, row_id, attempts, error)
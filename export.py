@@ -0,0 +1,88 @@
+import csv
+import io
+import itertools
+import json
+import time
+
+FORMATS = ('csv', 'jsonl')
+STATUSES = ('pending', 'served', 'all')
+COLUMNS = ('order_id', 'placed_at', 'served_at', 'status', 'customer_id', 'customer_name', 'items', 'total')
+FETCH_SIZE = 500
+
+
+def _timestamp(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds)) if seconds else ''
+
+def _item_rows(conn, since, until, status):
+    #one row per bowl, archive first, then the live tables; fetched FETCH_SIZE at a time.
+    #CROSS JOIN keeps orders as the outer loop, so orders come off a created_at index
+    #((created_at) for all statuses, (status, created_at) for one) already in order; sqlite
+    #only sorts the bowls of orders placed at the same instant, never the whole export
+    for orders, items in (('orders_archive', 'order_items_archive'), ('orders', 'order_items')):
+        where, params = "o.created_at >= ? AND o.created_at < ?", [since, until]
+        if status != 'all':
+            where += " AND o.status = ?"
+            params.append(status)
+        cursor = conn.execute(f"""SELECT o.id, o.customer_id, o.customer_name, o.total, o.status,
+                                         o.created_at, o.served_at, i.name, i.price, i.request
+                                  FROM {orders} o CROSS JOIN {items} i ON i.order_id = o.id
+                                  WHERE {where} ORDER BY o.created_at, o.id, i.position""", params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+def _orders(rows):
+    #consecutive bowls of the same order -> one order dict
+    for _, bowls in itertools.groupby(rows, key=lambda row: row['id']):
+        bowls = list(bowls)
+        first = bowls[0]
+        yield {
+            'order_id': first['id'],
+            'placed_at': _timestamp(first['created_at']),
+            'served_at': _timestamp(first['served_at']),
+            'status': first['status'],
+            'customer_id': first['customer_id'],
+            'customer_name': first['customer_name'],
+            'items': [{'name': b['name'], 'price': b['price'], 'request': b['request']} for b in bowls],
+            'total': first['total'],
+        }
+
+def _csv_lines(orders):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for order in orders:
+        items = '; '.join(i['name'] + (f" [{i['request']}]" if i['request'] else '') for i in order['items'])
+        writer.writerow([items if column == 'items' else order[column] for column in COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue() #the header, if there were no orders
+
+def _jsonl_lines(orders):
+    for order in orders:
+        yield json.dumps(order, ensure_ascii=False) + '\n'
+
+def write_orders(conn, out, fmt, since, until, status):
+    """Streams matching orders into the binary file `out`, returns how many.
+
+    Runs on a db reader thread (db.read), inside one read transaction so the
+    archiver moving rows halfway through can't drop or repeat an order.
+    """
+    count = 0
+    def counted(orders):
+        nonlocal count
+        for order in orders:
+            count += 1
+            yield order
+
+    conn.execute("BEGIN")
+    try:
+        lines = (_csv_lines if fmt == 'csv' else _jsonl_lines)(counted(_orders(_item_rows(conn, since, until, status))))
+        for line in lines:
+            out.write(line.encode())
+    finally:
+        conn.execute("COMMIT")
+    return count
@@ -1,158 +1,213 @@
 from typing import Final
-import uuid
-import sqlite3
+import asyncio
+import hashlib
 import json
+import secrets
+import signal
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
-    ContextTypes, CallbackQueryHandler, ConversationHandler
+    ContextTypes, CallbackQueryHandler, ConversationHandler, TypeHandler
 )
 import os
 from dotenv import load_dotenv
+from db import Database, Executors, SoldOut, split_item_name
+from queue_view import QueuePage, decode_key
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+from outbox import RateLimiter, message as outbox_message
+from metrics import Metrics, TimedRequest
+from shop import Shop
+import export
+from menu import MenuRegistry, ITEM_PATTERN, GRANOLA_PATTERN, DRIZZLE_PATTERN, DRIZZLE_TEXT
 
 load_dotenv()
 
 TOKEN = os.getenv('TELEGRAM_TOKEN')
+API_URL = os.getenv('TELEGRAM_API_URL') #defaults to api.telegram.org
+
+#'polling' or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') #public https url telegram should post to
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') #checked against X-Telegram-Bot-Api-Secret-Token
+
+#updates handled at once, a single user's updates still run one after another
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+
+#seconds between saving carts/conversation states to the db
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '5'))
+
+#idle customers lose their conversation and cart after this long
+SESSION_TIMEOUT = float(os.getenv('SESSION_TIMEOUT_MIN', '30')) * 60
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_SEC', '60'))
+
+#order caps, 0 = no limit; these are defaults, /setcap changes them at runtime
+MAX_PENDING = int(os.getenv('MAX_PENDING', '0'))
+MAX_PER_DROP = int(os.getenv('MAX_PER_DROP', '0'))
+WAITLIST_INVITE_MIN = float(os.getenv('WAITLIST_INVITE_MIN', '10'))
+
+#served orders move to the archive tables this long after serving, checked every ARCHIVE_INTERVAL_SEC
+ARCHIVE_AFTER = float(os.getenv('ARCHIVE_AFTER_MIN', '60')) * 60
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL_SEC', '300'))
+
+#seconds per order /status assumes until a few orders have been served
+SERVE_ESTIMATE = float(os.getenv('SERVE_ESTIMATE_SEC', '120'))
+
+#prometheus-style metrics at http://METRICS_HOST:METRICS_PORT/metrics, off unless a port is set
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
 
 admin_raw = os.getenv('ADMIN_IDS', '')
 SHOPKEEPER_IDS = [int(i) for i in admin_raw.split(',') if i]
 
+#json list of shops to run in this one process, each with its own token, db file, admins and menu;
+#unset = a single shop from the settings above
+SHOPS_FILE = os.getenv('SHOPS_FILE')
 
 
+
+#codes end up in callback_data, keep them short and dont reuse old ones
 MENU = {
-    'acai': {'name': 'Classic Acai Bowl', 'price': 6.00},
-    'banana': {'name': 'Banana Pudding Acai', 'price': 7.00},
+    'items': [
+        {'key': 'acai', 'code': 'a', 'name': 'Classic Acai Bowl', 'button': "🍓 Classic Acai Bowl", 'price': 6.00, 'customizable': True},
+        {'key': 'banana', 'code': 'b', 'name': 'Banana Pudding Acai', 'button': "🍌 Banana Pudding Acai", 'price': 7.00},
+    ],
+    'granola': [
+        {'key': 'choco_banana', 'code': 'cb', 'name': 'Choco Banana', 'button': "Choco Banana 🍫🍌"},
+        {'key': 'maple', 'code': 'mp', 'name': 'Maple', 'button': "Maple Syrup 🍁"},
+        {'key': 'matcha', 'code': 'mt', 'name': 'Matcha', 'button': "Matcha 🍵"},
+        {'key': 'strawberry', 'code': 'sb', 'name': 'Strawberry', 'button': "Strawberry 🍓"},
+    ],
+    'drizzle': [
+        {'key': 'hazelnut', 'code': 'hz', 'name': 'Hazelnut', 'button': "Hazelnut 🌰"},
+        {'key': 'peanut', 'code': 'pn', 'name': 'Peanut', 'button': "Peanut 🥜"},
+        {'key': 'honey', 'code': 'hn', 'name': 'Honey', 'button': "Honey 🍯"},
+        {'key': 'cookie', 'code': 'ck', 'name': 'Cookie', 'button': "Cookie 🍪"},
+    ],
 }
 
 MENU_STATE, GRANOLA_STATE, DRIZZLE_STATE, REQUEST_STATE = range(4)
 
+#shared by every shop in the process: the db threads, telegram flood limits and metrics
+db_executors = Executors()
+limiter = RateLimiter(global_rate=int(os.getenv('SEND_RATE_PER_SEC', '30')))
+metrics = Metrics()
+metrics_server = None
+running_shops = 0
+
+def make_shop(config):
+    db = Database(
+        config['db_path'],
+        batch_window=float(os.getenv('DB_BATCH_WINDOW_MS', '2')) / 1000,
+        batch_max=int(os.getenv('DB_BATCH_MAX', '200')),
+        executors=db_executors,
+    )
+    metrics.instrument_methods(db, 'db', config['name'])
+    shop = Shop(
+        config['name'], config['token'], db, MenuRegistry(config.get('menu', MENU)),
+        [int(i) for i in config.get('admin_ids', [])], limiter,
+        **{key: config[key] for key in ('title', 'shopkeeper', 'texts') if key in config},
+        page_size=int(os.getenv('QUEUE_PAGE_SIZE', '10')),
+        serve_batch=int(os.getenv('SERVE_BATCH', '5')),
+        debounce=float(os.getenv('QUEUE_DEBOUNCE_MS', '1000')) / 1000,
+        max_pending=config.get('max_pending', MAX_PENDING),
+        max_per_drop=config.get('max_per_drop', MAX_PER_DROP),
+        invite_ttl=WAITLIST_INVITE_MIN * 60,
+        session_ttl=SESSION_TIMEOUT,
+        session_sweep=SESSION_SWEEP_INTERVAL,
+        archive_after=ARCHIVE_AFTER,
+        archive_interval=ARCHIVE_INTERVAL,
+    )
+    db.stock_listener = lambda changes: on_stock_change(shop, changes)
+    shop.add_gauges(metrics)
+    return shop
+
+def load_shops():
+    #several shops from SHOPS_FILE (see shops.example.json), or the one set up by TELEGRAM_TOKEN/ADMIN_IDS/DB_PATH
+    if SHOPS_FILE:
+        with open(SHOPS_FILE) as f:
+            configs = json.load(f)
+    else:
+        configs = [{'name': os.getenv('SHOP_NAME', 'acai'), 'token': TOKEN,
+                    'db_path': os.getenv('DB_PATH', 'acai_bot.db'), 'admin_ids': SHOPKEEPER_IDS}]
+    names = [config['name'] for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"shop names must be unique, got {names}")
+    return [make_shop(config) for config in configs]
 
-def init_db():
-    conn = sqlite3.connect('acai_bot.db')
-    c = conn.cursor()
-    #orders table
-    c.execute('''CREATE TABLE IF NOT EXISTS orders (
-                    id TEXT PRIMARY KEY, 
-                    customer_id INTEGER, 
-                    customer_name TEXT, 
-                    items TEXT, 
-                    total REAL, 
-                    status TEXT)''')
-    #settings table
-    c.execute('''CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY, 
-                    value TEXT)''')
-    
-    #default shop status
-    c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('shop_open', '1')")
-    conn.commit()
-    conn.close()
-
-def is_shop_open() -> bool:
-    conn = sqlite3.connect('acai_bot.db')
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key='shop_open'")
-    result = c.fetchone() #returns list
-    conn.close()
-    return result[0] == '1' if result else True
-
-def set_shop_open(is_open: bool):
-    conn = sqlite3.connect('acai_bot.db')
-    c = conn.cursor()
-    c.execute("UPDATE settings SET value=? WHERE key='shop_open'", ('1' if is_open else '0',))
-    conn.commit()
-    conn.close()
-
-def add_order(order_id, customer_id, customer_name, items, total):
-    conn = sqlite3.connect('acai_bot.db')
-    c = conn.cursor()
-    #items as json string
-    c.execute("""INSERT INTO orders (id, customer_id, customer_name, items, total, status) 
-                 VALUES (?, ?, ?, ?, ?, 'pending')""",
-              (order_id, customer_id, customer_name, json.dumps(items), total))
-    conn.commit()
-    conn.close()
-
-def get_pending_orders():
-    conn = sqlite3.connect('acai_bot.db')
-    conn.row_factory = sqlite3.Row #format like dict
-    c = conn.cursor()
-    c.execute("SELECT * FROM orders WHERE status='pending'")
-    rows = c.fetchall()
-    conn.close()
-    
-    orders = []
-    for r in rows:
-        orders.append({
-            'id': r['id'],
-            'customer_id': r['customer_id'],
-            'customer_name': r['customer_name'],
-            'items': json.loads(r['items']), # json string to list of dicts
-            'total': r['total']
-        })
-    return orders
-
-def get_order(order_id):
-    conn = sqlite3.connect('acai_bot.db')
-    conn.row_factory = sqlite3.Row #format like dict
-    c = conn.cursor()
-    c.execute("SELECT * FROM orders WHERE id=?", (order_id,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return {
-            'id': row['id'],
-            'customer_id': row['customer_id'],
-            'customer_name': row['customer_name'],
-            'items': json.loads(row['items']),
-            'total': row['total']
-        }
-    return None
+shops = load_shops()
 
-def mark_order_served(order_id):
-    conn = sqlite3.connect('acai_bot.db')
-    c = conn.cursor()
-    c.execute("UPDATE orders SET status='served' WHERE id=?", (order_id,))
-    conn.commit()
-    conn.close()
 
 ###################################################################################################
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #entry pt in convhandler
-    if not is_shop_open():
-        await update.message.reply_text(
-            "🔴 **ACAILABILITY IS CLOSED** 🔴\n\nSorry, we are not accepting new orders right now :(\nIn the meantime, look out for the next drop in the telegram chat!",
-            parse_mode='Markdown'
-        )
+    shop = context.bot_data['shop']
+    if not shop.db.is_shop_open():
+        await update.message.reply_text(shop.text('closed'), parse_mode='Markdown')
+        return ConversationHandler.END
+
+    user_id = update.effective_user.id
+    if not shop.admission.can_enter(user_id):
+        await shop.admission.refill() #someone ahead may have let their invite lapse
+    if not shop.admission.can_enter(user_id):
+        await update.message.reply_text(await turned_away_text(shop, update), parse_mode='Markdown')
         return ConversationHandler.END
 
     if 'cart' not in context.user_data:
         context.user_data['cart'] = []
 
-    keyboard = [
-        [
-            InlineKeyboardButton("🍓 Classic Acai Bowl", callback_data='menu_acai'),
-            InlineKeyboardButton("🍌 Banana Pudding Acai", callback_data='menu_banana')
-        ],
-        [InlineKeyboardButton("🛒 View Cart / Checkout", callback_data='view_cart')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await update.message.reply_text(
-        "👋 Hello and welcome to Acailability! \n\nPlease select an item from the menu below to start your order:",
-        reply_markup=reply_markup
-    )
+    await update.message.reply_text(shop.text('welcome'), reply_markup=shop.menu.menu_markup)
     return MENU_STATE
 
+async def turned_away_text(shop, update: Update):
+    if shop.admission.drop_full():
+        return "🚫 **This drop is fully booked!**\nThanks for the love, look out for the next drop in the telegram chat!"
+    position = await shop.admission.wait(update.effective_user.id, update.effective_chat.id)
+    return shop.text('waitlist', position=position)
+
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    #answered from memory only, customers spam this during a drop
+    shop = context.bot_data['shop']
+    user_id = update.effective_user.id
+    orders = shop.db.pending.for_customer(user_id)
+    if not orders:
+        position = shop.admission.position(user_id)
+        if position:
+            text = f"🕒 You have no orders yet, you're **#{position}** on the waitlist."
+        else:
+            text = "You have no orders in the queue right now. Send /start to order!"
+        await update.message.reply_text(text, parse_mode='Markdown')
+        return
+
+    per_order = shop.db.serve_times.average() or SERVE_ESTIMATE
+    lines = []
+    for order in orders:
+        position = shop.db.pending.position_of(order['id'])
+        minutes = max(1, round(position * per_order / 60))
+        lines.append(f"🆔 Order #{order['id']}: **#{position}** in line, ready in about {minutes} min")
+    await update.message.reply_text("📋 **Your orders**\n\n" + '\n'.join(lines), parse_mode='Markdown')
+
 async def toggle_shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in SHOPKEEPER_IDS:
-        await update.message.reply_text("⛔️ Access Denied: You are not Melvin.")
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
         return
     
-    currently_open = is_shop_open()
+    currently_open = shop.db.is_shop_open()
     new_status = not currently_open
-    set_shop_open(new_status)
+    await shop.db.set_shop_open(new_status)
+    if new_status:
+        await shop.admission.new_drop()
     
     status_icon = "🟢" if new_status else "🔴"
     status_text = "OPEN" if new_status else "CLOSED"
@@ -160,138 +215,124 @@ async def toggle_shop_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.reply_text(f"✅ Shop status updated: **{status_text}** {status_icon}", parse_mode='Markdown')
 
 async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in SHOPKEEPER_IDS:
-        await update.message.reply_text("⛔️ Access Denied: You are not Melvin.")
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
         return
 
-    pending_orders = get_pending_orders()
-    if not pending_orders:
-        await update.message.reply_text("✅ The queue is currently empty!")
+    if not len(shop.db.pending):
+        message = await update.message.reply_text("✅ The queue is currently empty!")
+        shop.queue_view.remember(message.chat_id, message.message_id, QueuePage(message.text))
+        shop.live_queue.track(message.chat_id, message.message_id) #turns into the queue when the first order comes in
         return
 
     await update_queue_display(update, context, is_new_message=True)
 
-async def update_queue_display(update: Update, context: ContextTypes.DEFAULT_TYPE, is_new_message=False):
-    pending_orders = get_pending_orders()
-    
-    if not pending_orders:
-        text = "✅ All orders served! The queue is empty."
-        reply_markup = None
-        if is_new_message:
-            await update.message.reply_text(text)
-        else:
-            await update.callback_query.edit_message_text(text)
+async def update_queue_display(update: Update, context: ContextTypes.DEFAULT_TYPE, is_new_message=False, anchor=None, mode='from'):
+    shop = context.bot_data['shop']
+    if is_new_message:
+        page = shop.queue_view.render()
+        message = await update.message.reply_text(page.text, reply_markup=page.reply_markup, parse_mode='Markdown')
+        shop.queue_view.remember(message.chat_id, message.message_id, page)
+        shop.live_queue.track(message.chat_id, message.message_id)
         return
 
-    text = "📋 **Active Order Queue**\n\n"
-    keyboard = []
+    message = update.callback_query.message
+    if anchor is None:
+        anchor = shop.queue_view.anchor_for(message.chat_id, message.message_id) #stay on the same page
+    page = shop.queue_view.render(anchor, mode, shop.queue_view.selection(message.chat_id, message.message_id))
 
-    for order in pending_orders:
-        text += f"🆔 **#{order['id']}** | 👤 {order['customer_name']}\n"
-        for item in order['items']:
-            text += f" - {item['name']}\n"
-            if item.get('request'):
-                text += f"   ⚠️ *Note:* {item['request']}\n"
-                
-        text += f"💰 Total: ${order['total']:.2f}\n"
-        text += "-------------------\n"
-        
-        keyboard.append([InlineKeyboardButton(f"✅ Serve Order #{order['id']}", callback_data=f"serve_{order['id']}")])
-
-    keyboard.append([InlineKeyboardButton("🔄 Refresh Queue", callback_data="refresh_queue")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if shop.queue_view.is_shown(message.chat_id, message.message_id, page):
+        return #nothing changed, dont bother telegram
 
-    if is_new_message:
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
-    else:
-        await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    try:
+        await update.callback_query.edit_message_text(page.text, reply_markup=page.reply_markup, parse_mode='Markdown')
+    except BadRequest as e:
+        if 'not modified' not in str(e): #we forgot what this message showed, e.g. after a restart
+            raise
+    shop.queue_view.remember(message.chat_id, message.message_id, page)
 
 async def handle_menu_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
     query = update.callback_query
-    await query.answer()
-    
-    data = query.data
-    
-    if data == 'view_cart':
-        return await handle_cart(update, context)
+    item = shop.menu.lookup(query.data)
 
-    item_key = data.replace('menu_', '')
-    item = MENU.get(item_key)
-    
-    if not item:
-        if item_key == 'banana':
-             await query.answer("This item is currently unavailable.", show_alert=True)
+    if not item or not shop.menu.orderable(item):
+        await query.answer("This item is currently unavailable.", show_alert=True)
         return MENU_STATE
+    await query.answer()
 
-    if item_key == 'acai':
+    if item.customizable:
         context.user_data['current_customization'] = {
-            'name': item['name'],
-            'price': item['price'],
+            'name': item.name,
+            'price': item.price,
             'granola': None,
             'drizzle': None,
             'request': None #initialize empty request
         }
         
-        granola_buttons = [
-            [InlineKeyboardButton("Choco Banana 🍫🍌", callback_data='granola_choco_banana')],
-            [InlineKeyboardButton("Maple Syrup 🍁", callback_data='granola_maple')],
-            [InlineKeyboardButton("Matcha 🍵", callback_data='granola_matcha')],
-            [InlineKeyboardButton("Strawberry 🍓", callback_data='granola_strawberry')], 
-        ]
-        
         await query.edit_message_text(
-            text=f"Customizing **{item['name']}**\nChoose your Granola!",
-            reply_markup=InlineKeyboardMarkup(granola_buttons),
+            text=shop.menu.granola_texts[item.key],
+            reply_markup=shop.menu.granola_markup,
             parse_mode='Markdown'
         )
         return GRANOLA_STATE
 
     else:
-        context.user_data['cart'].append(item)
-        return await show_menu_again(update, context, f"✅ Added **{item['name']}** to cart!")
+        context.user_data.setdefault('cart', []).append(item.cart_item())
+        return await show_menu_again(update, context, f"✅ Added **{item.name}** to cart!")
 
 
 async def handle_granola(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
     query = update.callback_query
+    if 'current_customization' not in context.user_data:
+        return await session_expired(update, context)
+    choice = shop.menu.lookup(query.data)
+
+    if not choice or not choice.available:
+        await query.answer("That granola just ran out, please pick another.", show_alert=True)
+        if choice: #sold out since the keyboard was sent, show what is left
+            await query.edit_message_reply_markup(reply_markup=shop.menu.granola_markup)
+        return GRANOLA_STATE
     await query.answer()
-    
-    data = query.data
-    choice = data.replace('granola_', '').replace('_', ' ').title()
-    context.user_data['current_customization']['granola'] = choice
-    
-    drizzle_buttons = [
-        [InlineKeyboardButton("Hazelnut 🌰", callback_data='drizzle_hazelnut')],
-        [InlineKeyboardButton("Peanut 🥜", callback_data='drizzle_peanut')],
-        [InlineKeyboardButton("Honey 🍯", callback_data='drizzle_honey')],
-        [InlineKeyboardButton("Cookie 🍪", callback_data='drizzle_cookie')],
-    ]
+
+    context.user_data['current_customization']['granola'] = choice.name
     
     await query.edit_message_text(
-        text=f"Now choose your Drizzle!",
-        reply_markup=InlineKeyboardMarkup(drizzle_buttons),
+        text=DRIZZLE_TEXT,
+        reply_markup=shop.menu.drizzle_markup,
         parse_mode='Markdown'
     )
     return DRIZZLE_STATE
 
 async def handle_drizzle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
     query = update.callback_query
+    if 'current_customization' not in context.user_data:
+        return await session_expired(update, context)
+    choice = shop.menu.lookup(query.data)
+
+    if not choice or not choice.available:
+        await query.answer("That drizzle just ran out, please pick another.", show_alert=True)
+        if choice: #sold out since the keyboard was sent, show what is left
+            await query.edit_message_reply_markup(reply_markup=shop.menu.drizzle_markup)
+        return DRIZZLE_STATE
     await query.answer()
-    
-    data = query.data
-    choice = data.replace('drizzle_', '').title()
-    context.user_data['current_customization']['drizzle'] = choice
-    
-    keyboard = [[InlineKeyboardButton("⏭ Skip / No Requests", callback_data='skip_request')]]
+
+    context.user_data['current_customization']['drizzle'] = choice.name
     
     await query.edit_message_text(
-        text="📝 **Any special requests/messages for Melvin?**\nText it below (e.g., 'No bananas', 'I love Melvin'), or click the skip button :)",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        text=shop.text('request'),
+        reply_markup=shop.menu.request_markup,
         parse_mode='Markdown'
     )
     return REQUEST_STATE
 
 
 async def handle_special_request_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if 'current_customization' not in context.user_data:
+        return await session_expired(update, context)
     user_text = update.message.text
     if len(user_text) > 100:
         user_text = user_text[:100] + "..."
@@ -306,6 +347,8 @@ async def handle_special_request_skip(update: Update, context: ContextTypes.DEFA
     return await finalize_custom_item(update, context)
 
 async def finalize_custom_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if 'current_customization' not in context.user_data:
+        return await session_expired(update, context)
     temp_item = context.user_data['current_customization']
     
     final_name = f"{temp_item['name']} ({temp_item['granola']}, {temp_item['drizzle']} Drizzle)"
@@ -313,10 +356,13 @@ async def finalize_custom_item(update: Update, context: ContextTypes.DEFAULT_TYP
     final_item = {
         'name': final_name,
         'price': temp_item['price'],
-        'request': temp_item.get('request')
+        'request': temp_item.get('request'),
+        'item': temp_item['name'], #parts kept separately for the prep counts
+        'granola': temp_item['granola'],
+        'drizzle': temp_item['drizzle'],
     }
     
-    context.user_data['cart'].append(final_item)
+    context.user_data.setdefault('cart', []).append(final_item)
     
     #clean up temp data
     del context.user_data['current_customization']
@@ -333,38 +379,30 @@ async def finalize_custom_item(update: Update, context: ContextTypes.DEFAULT_TYP
 
 #no special req
 async def show_menu_again(update, context, message_text):
-    total_price = sum(i['price'] for i in context.user_data['cart'])
-    
-    keyboard = [
-        [InlineKeyboardButton("🍓 Classic Acai Bowl", callback_data='menu_acai')],
-        [InlineKeyboardButton("🛒 View Cart / Checkout", callback_data='view_cart')]
-    ]
+    shop = context.bot_data['shop']
+    total_price = sum(i['price'] for i in context.user_data.setdefault('cart', []))
     
     await update.callback_query.edit_message_text(
         text=f"{message_text}\n\nCurrent Total: ${total_price:.2f}\nWhat else would you like?",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=shop.menu.menu_markup,
         parse_mode='Markdown'
     )
     return MENU_STATE
 
 #special req
 async def show_menu_again_new_msg(update, context, message_text):
-    total_price = sum(i['price'] for i in context.user_data['cart'])
-    
-    keyboard = [
-        [InlineKeyboardButton("🍓 Classic Acai Bowl", callback_data='menu_acai')],
-        [InlineKeyboardButton("🛒 View Cart / Checkout", callback_data='view_cart')]
-    ]
+    shop = context.bot_data['shop']
+    total_price = sum(i['price'] for i in context.user_data.setdefault('cart', []))
     
     await update.message.reply_text(
         text=f"{message_text}\n\nCurrent Total: ${total_price:.2f}\nWhat else would you like?",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=shop.menu.menu_markup,
         parse_mode='Markdown'
     )
     return MENU_STATE
 
-async def handle_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.callback_query:
+async def handle_cart(update: Update, context: ContextTypes.DEFAULT_TYPE, notice=None, should_answer=True):
+    if update.callback_query and should_answer:
         await update.callback_query.answer()
 
     cart = context.user_data.get('cart', [])
@@ -382,11 +420,13 @@ async def handle_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text += f"\n**Total: ${sum(i['price'] for i in cart):.2f}**"
         
         keyboard = [
-            [InlineKeyboardButton("✅ Checkout", callback_data='checkout')],
+            [InlineKeyboardButton("✅ Checkout", callback_data=f"checkout_{secrets.token_urlsafe(6)}")], #token makes repeat taps idempotent
             [InlineKeyboardButton("❌ Remove Item", callback_data='remove_menu')],
             [InlineKeyboardButton("🔙 Back to Menu", callback_data='back_to_main')]
         ]
 
+    if notice:
+        text = f"{notice}\n\n{text}"
     if update.callback_query:
         await update.callback_query.edit_message_text(text=text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     else:
@@ -434,20 +474,70 @@ async def handle_delete_item(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except ValueError:
         return MENU_STATE
 
+def checkout_key(update: Update, cart):
+    #same button tapped twice -> same key; buttons from before tokens existed fall back to message + cart
+    query = update.callback_query
+    token = query.data.partition('_')[2]
+    if not token:
+        digest = hashlib.sha1(json.dumps(cart, sort_keys=True).encode()).hexdigest()[:12]
+        token = f"m{query.message.message_id}-{digest}"
+    return f"{update.effective_user.id}:{token}"
+
+async def show_order_confirmation(shop, query, order):
+    keyboard = [[InlineKeyboardButton("🆕 Order Again", callback_data='back_to_main')]]
+    try:
+        await query.edit_message_text(
+            text=f"🎉 **Order Confirmed!** 🎉\nOrder ID: #{order['id']}\n\nWe have received your order.\nTotal: **${order['total']:.2f}**\nSend /status to see your place in the queue.\n\n{shop.text('confirmed')}",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+    except BadRequest as e:
+        if 'not modified' not in str(e): #a repeat tap on an already confirmed order
+            raise
+    return MENU_STATE
+
 async def handle_checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
     query = update.callback_query
     await query.answer()
     
     cart = context.user_data.get('cart', [])
+    key = checkout_key(update, cart)
+
+    existing = await shop.db.get_order_by_checkout_key(key)
+    if existing: #double tap, nothing new to write or send
+        return await show_order_confirmation(shop, query, existing)
+    if not cart:
+        return await handle_cart(update, context, should_answer=False)
+
+    if not shop.admission.reserve(update.effective_user.id):
+        return await handle_cart(update, context, should_answer=False,
+                                 notice=(await turned_away_text(shop, update)) + "\nYour cart is saved for when it's your turn.")
+
+    ordered = False
+    try:
+        order = await place_order(update, context, cart, key)
+        ordered = order is not None
+    except SoldOut as e: #someone else got the last one while this cart was being built
+        context.user_data['cart'] = [item for item in cart if (e.kind, e.key) not in item_components(shop, item)]
+        return await handle_cart(update, context, should_answer=False,
+                                 notice=f"😢 Sorry, **{component_label(shop, e.kind, e.key)}** just sold out and was taken out of your cart.")
+    finally:
+        shop.admission.release(update.effective_user.id, ordered)
+    if order is None: #lost a race with another tap of the same button
+        order = await shop.db.get_order_by_checkout_key(key)
+
+    context.user_data['cart'] = []
+    return await show_order_confirmation(shop, query, order)
+
+async def place_order(update: Update, context: ContextTypes.DEFAULT_TYPE, cart, key):
+    shop = context.bot_data['shop']
     total_price = sum(i['price'] for i in cart)
-    order_id = str(uuid.uuid4())[:5]
+    order_id = shop.db.next_order_id()
 
     customer_id = update.effective_user.id
     customer_name = update.effective_user.username or update.effective_user.first_name
 
-    # save to db
-    add_order(order_id, customer_id, customer_name, list(cart), total_price)
-
     order_summary = ""
     for item in cart:
         order_summary += f"- {item['name']} (${item['price']:.2f})\n"
@@ -462,25 +552,130 @@ async def handle_checkout(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Items:\n{order_summary}\n"
         f"Use /queue to manage orders."
     )
-    
-    for admin_id in SHOPKEEPER_IDS:
-        try: #just in case admin cant get msg
-            await context.bot.send_message(chat_id=admin_id, text=shopkeeper_msg, parse_mode='Markdown')
-        except Exception:
-            pass
-    
-    context.user_data['cart'] = []
-    
-    keyboard = [[InlineKeyboardButton("🆕 Order Again", callback_data='back_to_main')]]
-    await query.edit_message_text(
-        text=f"🎉 **Order Confirmed!** 🎉\nOrder ID: #{order_id}\n\nWe have received your order.\nTotal: **${total_price:.2f}**\n\nThank you for shopping with Acailability!",
-        reply_markup=InlineKeyboardMarkup(keyboard),
-        parse_mode='Markdown'
-    )
-    return MENU_STATE
+
+    # save to db, admin notifications go out via the outbox
+    try:
+        order = await shop.db.add_order(order_id, customer_id, customer_name, list(cart), total_price,
+                                        messages=[outbox_message(admin_id, shopkeeper_msg, 'Markdown') for admin_id in shop.admin_ids],
+                                        checkout_key=key, needed=stock_needed(shop, cart))
+    except sqlite3.IntegrityError:
+        return None
+    return order
+
+def item_components(shop, item):
+    #(kind, key) of every stocked part of a cart item
+    if 'item' in item:
+        names = (item['item'], item.get('granola'), item.get('drizzle'))
+    else: #carts from before items carried their parts
+        names = split_item_name(item['name'])
+    components = []
+    for kind, name in zip(('items', 'granola', 'drizzle'), names):
+        option = shop.menu.find(kind, name) if name else None
+        if option:
+            components.append((kind, option.key))
+    return components
+
+def stock_needed(shop, cart):
+    return Counter(component for item in cart for component in item_components(shop, item))
+
+def component_label(shop, kind, key):
+    option = shop.menu.get(kind, key)
+    name = option.name if option else key
+    return name if kind == 'items' else f"{name} {kind}"
+
+def sync_menu_stock(shop):
+    #sold out options drop off the prebuilt keyboards
+    for kind, options in shop.menu.options.items():
+        for option in options:
+            quantity = shop.db.stock.get((kind, option.key))
+            shop.menu.set_available(kind, option.key, quantity is None or quantity > 0)
+
+def bowls_sold_out(shop):
+    return all(shop.db.stock.get(('items', option.key)) == 0 for option in shop.menu.options['items'])
+
+def on_stock_change(shop, changes):
+    sync_menu_stock(shop)
+    if any(kind == 'items' and quantity == 0 for (kind, _), quantity in changes.items()) and bowls_sold_out(shop):
+        if shop.closing is None or shop.closing.done(): #several orders can take the last bowls before it runs
+            shop.closing = asyncio.create_task(close_shop_sold_out(shop))
+
+async def close_shop_sold_out(shop):
+    if not shop.db.is_shop_open():
+        return
+    await shop.db.set_shop_open(False)
+    await shop.db.queue_messages([outbox_message(admin_id, "🔴 All bowls are sold out, the shop has been closed automatically.\n"
+                                                           "Use /setstock and /toggleshop to reopen.") for admin_id in shop.admin_ids])
+
+async def caps_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
+        return
+    await update.message.reply_text(f"🚦 Order caps\n{shop.admission.summary()}\n\n"
+                                    "Set with /setcap <pending|drop> <count|off>")
+
+async def set_cap_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
+        return
+
+    args = [a.lower() for a in context.args or []]
+    if len(args) != 2 or args[0] not in ('pending', 'drop') or not (args[1] == 'off' or args[1].isdigit()):
+        await update.message.reply_text("Usage: /setcap <pending|drop> <count|off>\n"
+                                        "pending = most orders waiting at once, drop = most orders until the shop reopens\n"
+                                        "e.g. /setcap pending 15")
+        return
+
+    cap = 0 if args[1] == 'off' else int(args[1])
+    if args[0] == 'pending':
+        await shop.admission.set_caps(max_pending=cap)
+    else:
+        await shop.admission.set_caps(max_per_drop=cap)
+    await update.message.reply_text(f"✅ Caps updated\n{shop.admission.summary()}")
+
+async def stock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
+        return
+    await update.message.reply_text(stock_text(shop))
+
+def stock_text(shop):
+    text = "📦 Stock (∞ = not tracked)\n"
+    for kind, title in (('items', "Bowls"), ('granola', "Granola"), ('drizzle', "Drizzle")):
+        text += f"\n{title}:\n"
+        for option in shop.menu.options[kind]:
+            quantity = shop.db.stock.get((kind, option.key))
+            text += f"{option.key}: {'∞' if quantity is None else quantity}{' (sold out)' if quantity == 0 else ''}\n"
+    text += "\nSet with /setstock <bowl|granola|drizzle> <name> <count|off>"
+    return text
+
+STOCK_KINDS = {'bowl': 'items', 'bowls': 'items', 'item': 'items', 'items': 'items', 'granola': 'granola', 'drizzle': 'drizzle'}
+
+async def set_stock_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
+        return
+
+    args = context.args or []
+    kind = STOCK_KINDS.get(args[0].lower()) if args else None
+    option = shop.menu.get(kind, args[1].lower()) if kind and len(args) == 3 else None
+    count = args[2].lower() if option else None
+    if option is None or not (count == 'off' or count.isdigit()):
+        await update.message.reply_text("Usage: /setstock <bowl|granola|drizzle> <name> <count|off>\ne.g. /setstock granola matcha 20\n\n" + stock_text(shop))
+        return
+
+    await shop.db.set_stock(kind, option.key, None if count == 'off' else int(count))
+    await update.message.reply_text(f"✅ {component_label(shop, kind, option.key)} stock set to {'∞' if count == 'off' else count}.\n\n" + stock_text(shop))
 
 async def handle_queue_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
     query = update.callback_query
+    if update.effective_user.id not in shop.admin_ids: #callback data can be forged, not just tapped
+        await query.answer(shop.text('access_denied'), show_alert=True)
+        return
     await query.answer()
     data = query.data
 
@@ -488,72 +683,344 @@ async def handle_queue_action(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update_queue_display(update, context, is_new_message=False)
         return
 
-    if data.startswith('serve_'):
-        order_id = data.replace('serve_', '')
-        
-        order_to_serve = get_order(order_id) #pull from db
-        
-        if order_to_serve:
-            try:
-                await context.bot.send_message(
-                    chat_id=order_to_serve['customer_id'],
-                    text=f"🥣 Order #{order_id} is ready!\nThank you for ordering with Acailability! 🍓🍌",
-                    parse_mode='Markdown'
-                )
-            except Exception:
-                pass
-
-            mark_order_served(order_id) #mark served in db
-            
-            for admin_id in SHOPKEEPER_IDS:
-                try:
-                    await context.bot.send_message(chat_id=admin_id, text=f"✅ Order #{order_id} marked served.")
-                except Exception:
-                    pass
-        
-        await update_queue_display(update, context, is_new_message=False)
+    if data.startswith('queue_'): #page buttons, queue_next_<key> / queue_prev_<key>
+        _, direction, raw_key = data.split('_', 2)
+        mode = 'after' if direction == 'next' else 'before'
+        await update_queue_display(update, context, anchor=decode_key(raw_key), mode=mode)
+        return
+
+    message = query.message
+    if data == 'bulk_on':
+        shop.queue_view.start_selecting(message.chat_id, message.message_id)
+    elif data == 'bulk_off':
+        shop.queue_view.stop_selecting(message.chat_id, message.message_id)
+    elif data.startswith('bulk_pick_'):
+        shop.queue_view.toggle(message.chat_id, message.message_id, data.replace('bulk_pick_', ''))
+    elif data == 'bulk_serve':
+        await serve_orders(shop, shop.queue_view.stop_selecting(message.chat_id, message.message_id))
+    elif data.startswith('bulk_next_'): #the button carries N, but only the configured batch is served
+        await serve_orders(shop, [o['id'] for o in shop.db.pending.page_from(None, shop.queue_view.serve_batch)])
+    elif data.startswith('serve_'):
+        await serve_orders(shop, [data.replace('serve_', '')])
+
+    await update_queue_display(update, context, is_new_message=False) #once per tap, however many were served
+
+async def serve_orders(shop, order_ids):
+    #one transaction for the whole batch, the outbox then messages the customers in parallel
+    orders = [order for order in map(shop.db.pending.get, order_ids) if order]
+
+    def notify(served):
+        messages = [outbox_message(
+            order['customer_id'],
+            shop.text('ready', order_id=order['id']),
+            'Markdown'
+        ) for order in served]
+        numbers = ', '.join(f"#{order['id']}" for order in served)
+        summary = f"✅ Order {numbers} marked served." if len(served) == 1 else f"✅ {len(served)} orders marked served: {numbers}"
+        messages += [outbox_message(admin_id, summary) for admin_id in shop.admin_ids] #one per admin, not one per order
+        return messages
+
+    served = await shop.db.mark_orders_served(orders, notify)
+    if served:
+        await shop.admission.refill() #freed slots go to the waitlist, in order
+    return served
+
+async def session_expired(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    #a tap on a menu left idle past SESSION_TIMEOUT, its cart is already gone
+    context.user_data.pop('current_customization', None)
+    text = (f"⌛ **Your session expired**\nThis menu was idle for over {SESSION_TIMEOUT / 60:g} minutes, so your cart was cleared.\n\n"
+            f"Send /start to begin a new order!")
+    if update.callback_query:
+        await update.callback_query.answer("Session expired, send /start to order again.")
+        try:
+            await update.callback_query.edit_message_text(text, parse_mode='Markdown')
+        except BadRequest as e:
+            if 'not modified' not in str(e):
+                raise
+    elif update.message:
+        await update.message.reply_text(text, parse_mode='Markdown')
+    return ConversationHandler.END
+
+async def conversation_timed_out(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    #runs from the job queue when conversation_timeout hits, nothing is sent until they tap again
+    context.user_data.pop('cart', None)
+    context.user_data.pop('current_customization', None)
 
 async def back_to_main_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     return await show_menu_again(update, context, "👋 Welcome back!")
 
+async def prep_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
+        return
+
+    counts = await shop.db.get_prep_counts()
+    if not counts:
+        await update.message.reply_text("✅ Nothing to prep, the queue is empty!")
+        return
+
+    totals = {'item': {}, 'granola': {}, 'drizzle': {}}
+    for row in counts:
+        for part, tally in totals.items():
+            if row[part]:
+                tally[row[part]] = tally.get(row[part], 0) + row['count']
+
+    text = f"🧑‍🍳 **Prep list** ({sum(totals['item'].values())} bowls pending)\n"
+    for title, part in (("🥣 Bowls", 'item'), ("🌾 Granola", 'granola'), ("🍯 Drizzle", 'drizzle')):
+        if totals[part]:
+            text += f"\n**{title}**\n"
+            for name, count in sorted(totals[part].items(), key=lambda kv: -kv[1]):
+                text += f"{count} x {name}\n"
+
+    combos = [row for row in sorted(counts, key=lambda r: -r['count']) if row['granola']]
+    if combos: #only customized bowls have combos
+        text += "\n**Combos**\n"
+        for row in combos:
+            text += f"{row['count']} x {row['item']}, {row['granola']}, {row['drizzle']}\n"
+    await update.message.reply_text(text, parse_mode='Markdown')
+
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    #/report [days], read from the sales rollups so it stays instant however many orders there are
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
+        return
+
+    try:
+        days = int(context.args[0]) if context.args else 7
+    except ValueError:
+        days = 0
+    if days < 1:
+        await update.message.reply_text("Usage: /report [days], e.g. /report 30")
+        return
+
+    since = time.strftime('%Y-%m-%d', time.localtime(time.time() - (days - 1) * 86400))
+    daily, components = await shop.db.get_sales(since)
+    if not daily:
+        await update.message.reply_text(f"📈 No sales in the last {days} day(s) yet.")
+        return
+
+    text = f"📈 **Sales, last {days} day(s)**\n\n"
+    for row in daily:
+        text += f"{row['day']}: {row['orders']} orders, {row['bowls']} bowls, ${row['revenue']:.2f}\n"
+    text += (f"**Total: {sum(r['orders'] for r in daily)} orders, {sum(r['bowls'] for r in daily)} bowls, "
+             f"${sum(r['revenue'] for r in daily):.2f}**\n")
+    for title, kind in (("🥣 Bowls", 'item'), ("🌾 Granola", 'granola'), ("🍯 Drizzle", 'drizzle')):
+        if components.get(kind):
+            text += f"\n**{title}**\n"
+            for row in components[kind]:
+                revenue = f" (${row['revenue']:.2f})" if kind == 'item' else '' #toppings are not priced
+                text += f"{row['count']} x {row['key']}{revenue}\n"
+    await update.message.reply_text(text, parse_mode='Markdown')
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    #/export [csv|jsonl] [pending|served|all] [from YYYY-MM-DD [to YYYY-MM-DD]], any order
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
+        return
+
+    fmt, status, days = 'csv', 'all', []
+    try:
+        for arg in context.args:
+            if arg.lower() in export.FORMATS:
+                fmt = arg.lower()
+            elif arg.lower() in export.STATUSES:
+                status = arg.lower()
+            else:
+                days.append(date.fromisoformat(arg))
+        if len(days) > 2:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("Usage: /export [csv|jsonl] [pending|served|all] [from YYYY-MM-DD [to YYYY-MM-DD]]")
+        return
+
+    #one date means from that day onward, two mean that range with the last day included
+    since = time.mktime(days[0].timetuple()) if days else 0
+    until = time.mktime((days[1] + timedelta(days=1)).timetuple()) if len(days) == 2 else time.time() + 1
+    name = f"orders-{status}"
+    if days:
+        name += f"-{days[0]:%Y%m%d}-" + (f"{days[1]:%Y%m%d}" if len(days) == 2 else 'now')
+
+    with tempfile.TemporaryFile() as out: #written row by row on a reader thread, the loop keeps serving
+        count = await shop.db.read(export.write_orders, out, fmt, since, until, status)
+        if not count:
+            await update.message.reply_text("📦 No orders match that export.")
+            return
+        out.seek(0)
+        await update.message.reply_document(document=out, filename=f"{name}.{fmt}",
+                                            caption=f"📦 {count} orders ({status})")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shop = context.bot_data['shop']
+    if update.effective_user.id not in shop.admin_ids:
+        await update.message.reply_text(shop.text('access_denied'))
+        return
+
+    text = "📊 Bot stats\n\nHandlers:\n"
+    text += '\n'.join(metrics.summary('handler', shop.name)[:15]) or "nothing yet"
+    text += "\n\nDB calls:\n"
+    text += '\n'.join(metrics.summary('db', shop.name)[:10]) or "nothing yet"
+    text += "\n\nTelegram API:\n"
+    text += '\n'.join(metrics.summary('telegram_api', shop.name)[:8]) or "nothing yet"
+    text += f"\n\nDB: {shop.db.stats.summary()}\nSettings: {shop.db.settings.summary()}\n"
+    text += f"Outbox: {shop.outbox.sent} sent, {shop.outbox.retries} retries, {shop.outbox.failed} failed, {shop.outbox.pending()} queued\n"
+    text += f"Admission: {shop.admission.summary()}\n"
+    text += f"Sessions: {shop.sessions.summary()}\n"
+    text += f"Archive: {shop.archiver.archived} orders archived since start\n"
+    text += f"Live queue: {shop.live_queue.edits} edits, {shop.live_queue.skipped} skipped as unchanged\n"
+    text += f"Pending orders: {len(shop.db.pending)}"
+    await update.message.reply_text(text) #no markdown, handler names have underscores
+
+async def startup(application: Application):
+    global metrics_server, running_shops
+    shop = application.bot_data['shop']
+    await shop.outbox.start(application.bot)
+    shop.live_queue.start(application.bot)
+    sync_menu_stock(shop)
+    await shop.admission.load()
+    shop.sessions.start(application)
+    shop.archiver.start()
+    running_shops += 1
+    if METRICS_PORT and metrics_server is None: #one endpoint for all shops
+        metrics_server = await metrics.serve(METRICS_HOST, METRICS_PORT)
+        print(f'Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics')
+
+async def shutdown(application: Application):
+    global metrics_server, running_shops
+    shop = application.bot_data['shop']
+    running_shops -= 1
+    if metrics_server and not running_shops:
+        metrics_server.close()
+        metrics_server = None
+    await shop.live_queue.stop()
+    if shop.closing: #let an automatic close finish writing
+        await asyncio.gather(shop.closing, return_exceptions=True)
+    await shop.sessions.stop()
+    await shop.archiver.stop()
+    await shop.admission.stop()
+    await shop.outbox.stop()
+    print(f'{shop.name} DB writes: {shop.db.stats.summary()}')
+    print(f'{shop.name} settings: {shop.db.settings.summary()}')
+    shop.db.close()
+
 async def error(update: Update, context: ContextTypes.DEFAULT_TYPE):
     print(f'Update {update} caused error {context.error}')
 
-if __name__ == '__main__':
-    print('Initializing database...')
-    init_db()  #initialise db on start
-
-    print('Starting bot...')
-    app = Application.builder().token(TOKEN).build()
+def build_app(shop):
+    builder = (
+        Application.builder().token(shop.token)
+        .persistence(SQLitePersistence(shop.db, update_interval=PERSISTENCE_INTERVAL, session_ttl=SESSION_TIMEOUT))
+        .request(TimedRequest(metrics, shop.name, connection_pool_size=256))
+        .post_init(startup).post_shutdown(shutdown)
+    )
+    if API_URL: #e.g. a local bot api server, or the fake one in bench/
+        builder = builder.base_url(f"{API_URL}/bot").base_file_url(f"{API_URL}/file/bot")
+    if UPDATE_CONCURRENCY > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+    app = builder.build()
+    app.bot_data['shop'] = shop #how handlers find their shop, bot_data is not persisted
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start_command)],
         states={
             MENU_STATE: [
-                CallbackQueryHandler(handle_menu_selection, pattern='^menu_'),
+                CallbackQueryHandler(handle_menu_selection, pattern=ITEM_PATTERN),
                 CallbackQueryHandler(handle_cart, pattern='^view_cart$'),
                 CallbackQueryHandler(handle_remove_menu, pattern='^remove_menu$'), 
                 CallbackQueryHandler(handle_delete_item, pattern='^delete_'),      
-                CallbackQueryHandler(handle_checkout, pattern='^checkout$'),
+                CallbackQueryHandler(handle_checkout, pattern='^checkout'),
                 CallbackQueryHandler(back_to_main_handler, pattern='^back_to_main$')
             ],
-            GRANOLA_STATE: [CallbackQueryHandler(handle_granola, pattern='^granola_')],
-            DRIZZLE_STATE: [CallbackQueryHandler(handle_drizzle, pattern='^drizzle_')],
+            GRANOLA_STATE: [CallbackQueryHandler(handle_granola, pattern=GRANOLA_PATTERN)],
+            DRIZZLE_STATE: [CallbackQueryHandler(handle_drizzle, pattern=DRIZZLE_PATTERN)],
             REQUEST_STATE: [
                 CallbackQueryHandler(handle_special_request_skip, pattern='^skip_request$'),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_special_request_text)
-            ]
+            ],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timed_out)],
         },
-        fallbacks=[CommandHandler('start', start_command)]
+        fallbacks=[CommandHandler('start', start_command)],
+        name='order_conversation',
+        persistent=True,
+        conversation_timeout=SESSION_TIMEOUT,
     )
 
+    app.add_handler(TypeHandler(Update, shop.sessions.touch), group=-1)
     app.add_handler(conv_handler)
+    #customer buttons that reach here belong to a conversation that already ended
+    app.add_handler(CallbackQueryHandler(session_expired, pattern=f"{ITEM_PATTERN}|{GRANOLA_PATTERN}|{DRIZZLE_PATTERN}|"
+                                         "^(view_cart|remove_menu|delete_|checkout|back_to_main|skip_request)"))
+    app.add_handler(CommandHandler('status', status_command))
     app.add_handler(CommandHandler('queue', queue_command))
     app.add_handler(CommandHandler('toggleshop', toggle_shop_command))
-    app.add_handler(CallbackQueryHandler(handle_queue_action, pattern='^(serve_|refresh_queue)'))
+    app.add_handler(CommandHandler('stats', stats_command))
+    app.add_handler(CommandHandler('prep', prep_command))
+    app.add_handler(CommandHandler('report', report_command))
+    app.add_handler(CommandHandler('export', export_command))
+    app.add_handler(CommandHandler('stock', stock_command))
+    app.add_handler(CommandHandler('setstock', set_stock_command))
+    app.add_handler(CommandHandler('caps', caps_command))
+    app.add_handler(CommandHandler('setcap', set_cap_command))
+    app.add_handler(CallbackQueryHandler(handle_queue_action, pattern='^(serve_|refresh_queue|queue_|bulk_)'))
     app.add_error_handler(error)
+    metrics.instrument_handlers(app, shop.name)
+    return app
+
+async def run_shops(apps):
+    #what run_polling/run_webhook do for one app, for several apps on one event loop
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    for i, app in enumerate(apps):
+        shop = app.bot_data['shop']
+        await app.initialize()
+        await startup(app)
+        if BOT_MODE == 'webhook': #one port and path per shop, e.g. behind a reverse proxy
+            path = f"{WEBHOOK_PATH.strip('/')}/{shop.name}".lstrip('/')
+            print(f'{shop.name}: listening for webhooks on port {WEBHOOK_PORT + i}, path /{path}...')
+            await app.updater.start_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT + i,
+                url_path=path,
+                secret_token=WEBHOOK_SECRET,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{shop.name}" if WEBHOOK_URL else None,
+            )
+        else:
+            print(f'{shop.name}: polling...')
+            await app.updater.start_polling(poll_interval=0.1)
+        await app.start()
+
+    await stop.wait()
+    for app in apps:
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+        await shutdown(app)
 
-    print('Polling...')
-    app.run_polling(poll_interval=0.1)
\ No newline at end of file
+if __name__ == '__main__':
+    print('Initializing database...')
+    for shop in shops:
+        shop.db.init()  #initialise db on start
+
+    print('Starting bot...')
+    if len(shops) > 1:
+        print(f"Running {len(shops)} shops: {', '.join(shop.name for shop in shops)}")
+        asyncio.run(run_shops([build_app(shop) for shop in shops]))
+    elif BOT_MODE == 'webhook':
+        print(f'Listening for webhooks on port {WEBHOOK_PORT}...')
+        build_app(shops[0]).run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            webhook_url=WEBHOOK_URL,
+        )
+    else:
+        print('Polling...')
+        build_app(shops[0]).run_polling(poll_interval=0.1)
@@ -0,0 +1,89 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+#callback_data prefixes, one letter so buttons stay well under telegram's 64 bytes
+PREFIXES = {'items': 'm:', 'granola': 'g:', 'drizzle': 'd:'}
+#what the same buttons sent before the registry, still accepted from old messages
+LEGACY_PREFIXES = {'items': 'menu_', 'granola': 'granola_', 'drizzle': 'drizzle_'}
+
+ITEM_PATTERN = '^(m:|menu_)'
+GRANOLA_PATTERN = '^(g:|granola_)'
+DRIZZLE_PATTERN = '^(d:|drizzle_)'
+
+DRIZZLE_TEXT = "Now choose your Drizzle!"
+
+
+class Option:
+    def __init__(self, kind, spec):
+        self.kind = kind
+        self.key = spec['key']
+        self.code = spec['code']
+        self.name = spec['name']
+        self.button = spec.get('button', spec['name'])
+        self.price = spec.get('price', 0.0)
+        self.customizable = spec.get('customizable', False)
+        self.available = spec.get('available', True)
+        self.data = PREFIXES[kind] + self.code
+
+    def cart_item(self):
+        return {'name': self.name, 'price': self.price, 'item': self.name}
+
+
+class MenuRegistry:
+    """Every menu item and topping, and the keyboards and texts built from them.
+
+    The menu is declared once as data (see MENU in main.py). Keyboards are
+    built up front and only rebuilt when availability changes, and incoming
+    callback_data is resolved with a dict lookup instead of string parsing.
+    """
+
+    def __init__(self, spec):
+        self.options = {kind: [Option(kind, s) for s in spec.get(kind, [])] for kind in PREFIXES}
+        self._by_data = {}
+        for kind, options in self.options.items():
+            for option in options:
+                self._by_data[option.data] = option
+                self._by_data[LEGACY_PREFIXES[kind] + option.key] = option
+        self.version = 0
+        self._build()
+
+    def _build(self):
+        items = [o for o in self.options['items'] if self.orderable(o)]
+        buttons = [InlineKeyboardButton(o.button, callback_data=o.data) for o in items]
+        rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+        rows.append([InlineKeyboardButton("🛒 View Cart / Checkout", callback_data='view_cart')])
+        self.menu_markup = InlineKeyboardMarkup(rows)
+
+        self.granola_markup = self._column('granola')
+        self.drizzle_markup = self._column('drizzle')
+        self.request_markup = InlineKeyboardMarkup([[InlineKeyboardButton("⏭ Skip / No Requests", callback_data='skip_request')]])
+        self.granola_texts = {o.key: f"Customizing **{o.name}**\nChoose your Granola!" for o in self.options['items']}
+        self.version += 1
+
+    def _column(self, kind):
+        return InlineKeyboardMarkup([[InlineKeyboardButton(o.button, callback_data=o.data)]
+                                     for o in self.options[kind] if o.available])
+
+    def orderable(self, item):
+        #a bowl that needs a granola and a drizzle is only on the menu while some of each are left
+        if not item.available:
+            return False
+        return not item.customizable or all(any(o.available for o in self.options[kind]) for kind in ('granola', 'drizzle'))
+
+    def lookup(self, data):
+        return self._by_data.get(data)
+
+    def get(self, kind, key):
+        return next((o for o in self.options[kind] if o.key == key), None)
+
+    def find(self, kind, name):
+        #cart items carry display names
+        return next((o for o in self.options[kind] if o.name == name), None)
+
+    def set_available(self, kind, key, available):
+        #returns True if anything changed, keyboards are rebuilt only then
+        option = self.get(kind, key)
+        if option is None or option.available == available:
+            return False
+        option.available = available
+        self._build()
+        return True
@@ -0,0 +1,181 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import time
+from telegram.ext import ConversationHandler
+from telegram.request import HTTPXRequest
+
+#histogram bucket upper bounds, seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'sum', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        #upper bound of the bucket the q-th observation falls in
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound if bound != float('inf') else BUCKETS[-2]
+        return BUCKETS[-2]
+
+
+class Metrics:
+    """Latency histograms and counters, cheap enough to leave on during a drop.
+
+    Histograms are grouped in families ('handler', 'db', 'telegram_api') and
+    labelled by name, and by shop when several shops share one Metrics. Counters and gauges that live elsewhere (outbox retries,
+    db batch stats, ...) are registered as callables and read on demand.
+    """
+
+    def __init__(self):
+        self.histograms = {} #(family, name, shop) -> Histogram
+        self.gauges = {} #metric name -> callable returning a number
+
+    def observe(self, family, name, seconds, error=False, shop=''):
+        histogram = self.histograms.get((family, name, shop))
+        if histogram is None:
+            histogram = self.histograms[(family, name, shop)] = Histogram()
+        histogram.observe(seconds, error)
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def timed(self, family, name, fn, shop=''):
+        #wrap a coroutine function so every call is recorded
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except BaseException:
+                self.observe(family, name, time.perf_counter() - start, error=True, shop=shop)
+                raise
+            self.observe(family, name, time.perf_counter() - start, shop=shop)
+            return result
+        return wrapper
+
+    def instrument_handlers(self, app, shop=''):
+        #wrap the callback of every handler registered on the app, including inside conversations
+        def walk(handlers):
+            for handler in handlers:
+                if isinstance(handler, ConversationHandler):
+                    walk(handler.entry_points)
+                    for state_handlers in handler.states.values():
+                        walk(state_handlers)
+                    walk(handler.fallbacks)
+                elif not getattr(handler.callback, '_instrumented', False):
+                    handler.callback = self.timed('handler', handler.callback.__name__, handler.callback, shop)
+                    handler.callback._instrumented = True
+
+        for group in app.handlers.values():
+            walk(group)
+        for fn, block in list(app.error_handlers.items()):
+            if not getattr(fn, '_instrumented', False):
+                del app.error_handlers[fn]
+                wrapped = self.timed('handler', fn.__name__, fn, shop)
+                wrapped._instrumented = True
+                app.error_handlers[wrapped] = block
+
+    def instrument_methods(self, obj, family, shop=''):
+        #wrap every public coroutine method of obj, e.g. a Database
+        for name, method in inspect.getmembers(obj, inspect.iscoroutinefunction):
+            if not name.startswith('_'):
+                setattr(obj, name, self.timed(family, name, method, shop))
+
+    #output ##################################################################################
+
+    def prometheus(self):
+        lines = []
+        families = sorted({family for family, _, _ in self.histograms})
+        labels = lambda name, shop: f'name="{name}"' + (f',shop="{shop}"' if shop else '')
+        for family in families:
+            lines.append(f"# TYPE acai_{family}_seconds histogram")
+            for (fam, name, shop), h in sorted(self.histograms.items()):
+                if fam != family:
+                    continue
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'acai_{family}_seconds_bucket{{{labels(name, shop)},le="{le}"}} {cumulative}')
+                lines.append(f'acai_{family}_seconds_sum{{{labels(name, shop)}}} {h.sum}')
+                lines.append(f'acai_{family}_seconds_count{{{labels(name, shop)}}} {h.count}')
+            lines.append(f"# TYPE acai_{family}_errors_total counter")
+            for (fam, name, shop), h in sorted(self.histograms.items()):
+                if fam == family:
+                    lines.append(f'acai_{family}_errors_total{{{labels(name, shop)}}} {h.errors}')
+        for name, fn in sorted(self.gauges.items()):
+            lines.append(f"acai_{name} {fn()}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, family, shop=''):
+        #one shop's histograms, so /stats in one shop doesn't show another's traffic
+        rows = []
+        for (fam, name, label), h in sorted(self.histograms.items(), key=lambda kv: -kv[1].count):
+            if fam == family and label == shop:
+                rows.append(f"{name}: {h.count}x p50≤{h.quantile(0.5) * 1000:g}ms "
+                            f"p95≤{h.quantile(0.95) * 1000:g}ms err {h.errors}")
+        return rows
+
+    #http endpoint ###########################################################################
+
+    async def serve(self, host, port):
+        async def handle(reader, writer):
+            try:
+                request_line = await reader.readline()
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass #skip headers
+                if request_line.split(b' ')[1:2] == [b'/metrics']:
+                    status, body = '200 OK', self.prometheus().encode()
+                else:
+                    status, body = '404 Not Found', b'try /metrics\n'
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+                await writer.drain()
+            except (ConnectionError, IndexError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest that records how long each Bot API call takes."""
+
+    def __init__(self, metrics, shop='', **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.shop = shop
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        start = time.perf_counter()
+        api_method = url.rsplit('/', 1)[-1]
+        try:
+            result = await super().do_request(url, method, request_data=request_data, **kwargs)
+        except BaseException:
+            self.metrics.observe('telegram_api', api_method, time.perf_counter() - start, error=True, shop=self.shop)
+            raise
+        #flood control and other api errors come back as status codes, not exceptions
+        self.metrics.observe('telegram_api', api_method, time.perf_counter() - start, error=result[0] >= 400, shop=self.shop)
+        return result
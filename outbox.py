@@ -0,0 +1,191 @@
+import asyncio
+import random
+import time
+from collections import deque
+from datetime import timedelta
+from telegram.error import BadRequest, ChatMigrated, Forbidden, InvalidToken, RetryAfter
+
+
+def message(chat_id, text, parse_mode=None):
+    return {'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        #how long until a token is free, without taking it
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        #take a token (possibly going into debt), returns how long to wait before using it
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """Token buckets matching telegram's flood limits.
+
+    Roughly 30 messages a second across all chats, and about one a second
+    into any single chat (with a small burst allowance).
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+
+    def _chat(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000: #forget chats that have been quiet long enough to refill
+                now = time.monotonic()
+                self._chats = {c: b for c, b in self._chats.items() if not b.is_full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def chat_wait(self, chat_id):
+        return self._chat(chat_id).wait_time(time.monotonic())
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        wait = max(self._global.take(now), self._chat(chat_id).take(now))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class OutboxDispatcher:
+    """Sends the rows of the outbox table in the background.
+
+    Handlers only write outbox rows (see Database.add_order and friends) and
+    return. Chats are worked on concurrently, messages within one chat go out
+    in order. Flood control waits are honoured, network errors are retried
+    with exponential backoff, and anything still queued is picked up again
+    from the table after a restart.
+    """
+
+    def __init__(self, db, limiter=None, concurrency=8, max_attempts=5, base_backoff=1.0, max_backoff=300.0):
+        self.db = db
+        self.limiter = limiter or RateLimiter()
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.bot = None
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self._chats = {} #chat_id -> deque of rows, only chats with work
+        self._ready = asyncio.Queue()
+        self._workers = []
+        db.outbox_listener = self.push
+
+    async def start(self, bot):
+        self.bot = bot
+        self.push(await self.db.get_queued_messages())
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def pending(self):
+        return sum(len(rows) for rows in self._chats.values())
+
+    def push(self, rows):
+        for row in rows:
+            chat_rows = self._chats.get(row['chat_id'])
+            if chat_rows is not None:
+                chat_rows.append(row) #chat is already scheduled
+                continue
+            self._chats[row['chat_id']] = deque([row])
+            self._schedule(row['chat_id'], row.get('next_attempt_at', 0) - time.time())
+
+    def _schedule(self, chat_id, delay):
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    async def _work(self):
+        while True:
+            chat_id = await self._ready.get()
+
+            wait = self.limiter.chat_wait(chat_id)
+            if wait > 0: #dont hold a worker while this chat cools down
+                self._schedule(chat_id, wait)
+                continue
+
+            try:
+                chat_rows = self._chats[chat_id]
+                await self.limiter.acquire(chat_id)
+                retry_in = await self._send(chat_rows[0])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e: #e.g. the db write after a send failed, keep the chat scheduled
+                print(f"Outbox error for chat {chat_id}: {e!r}")
+                self._schedule(chat_id, self.base_backoff * random.uniform(0.8, 1.2))
+                continue
+
+            if retry_in is None:
+                chat_rows.popleft()
+                if not chat_rows:
+                    del self._chats[chat_id]
+                    continue
+                retry_in = 0
+            self._schedule(chat_id, retry_in)
+
+    async def _send(self, row):
+        #returns None when the row is done with (sent or given up), else seconds until the next try
+        if not row.get('delivered'):
+            try:
+                await self.bot.send_message(chat_id=row['chat_id'], text=row['text'], parse_mode=row['parse_mode'])
+            except RetryAfter as e:
+                retry_in = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                return await self._retry(row, row['attempts'], retry_in, e) #flood control isnt the message's fault
+            except BadRequest as e:
+                if row['parse_mode'] and 'parse entities' in str(e):
+                    row['parse_mode'] = None #e.g. an underscore in a username, send it as plain text instead
+                    return 0
+                return await self._fail(row, e)
+            except (Forbidden, ChatMigrated, InvalidToken) as e: #user blocked us, chat gone, ...
+                return await self._fail(row, e)
+            except Exception as e: #network trouble, try again later
+                attempts = row['attempts'] + 1
+                if attempts >= self.max_attempts:
+                    row['attempts'] = attempts
+                    return await self._fail(row, e)
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+                return await self._retry(row, attempts, backoff * random.uniform(0.8, 1.2), e)
+            row['delivered'] = True #only the db write is retried from here, never the send
+            self.sent += 1
+        await self.db.message_sent(row['id'])
+        return None
+
+    async def _retry(self, row, attempts, retry_in, error):
+        self.retries += 1
+        row['attempts'] = attempts
+        await self.db.message_retry(row['id'], attempts, time.time() + retry_in, repr(error))
+        return retry_in
+
+    async def _fail(self, row, error):
+        self.failed += 1
+        print(f"Giving up on message to {row['chat_id']}: {error}")
+        await self.db.message_failed(row['id'], row['attempts'], repr(error))
+        return None
@@ -0,0 +1,127 @@
+import json
+import time
+from telegram.ext import BasePersistence, PersistenceInput
+
+
+def _select_user_data(conn, user_id):
+    rows = conn.execute("SELECT key, value FROM user_data WHERE user_id=?", (user_id,))
+    return {row['key']: row['value'] for row in rows}
+
+def _write_user_data(conn, user_id, changed, removed):
+    now = time.time()
+    conn.executemany("""INSERT INTO user_data (user_id, key, value, updated_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(user_id, key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at""",
+                     [(user_id, key, value, now) for key, value in changed.items()])
+    conn.executemany("DELETE FROM user_data WHERE user_id=? AND key=?", [(user_id, key) for key in removed])
+
+def _delete_user_data(conn, user_id):
+    conn.execute("DELETE FROM user_data WHERE user_id=?", (user_id,))
+
+def _delete_stale(conn, cutoff, keep_user_ids):
+    #a user still in memory may have an old row for a key that just hasnt changed lately
+    conn.execute("""DELETE FROM user_data WHERE updated_at < ?
+                    AND user_id NOT IN (SELECT value FROM json_each(?))""", (cutoff, json.dumps(keep_user_ids)))
+    conn.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,))
+
+def _select_conversations(conn, name, cutoff):
+    rows = conn.execute("SELECT key, state FROM conversations WHERE name=? AND updated_at >= ?", (name, cutoff))
+    return {tuple(json.loads(row['key'])): json.loads(row['state']) for row in rows}
+
+def _write_conversation(conn, name, key, state):
+    if state is None:
+        conn.execute("DELETE FROM conversations WHERE name=? AND key=?", (name, key))
+    else:
+        conn.execute("""INSERT INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(name, key) DO UPDATE SET state=excluded.state, updated_at=excluded.updated_at""",
+                     (name, key, json.dumps(state), time.time()))
+
+
+class SQLitePersistence(BasePersistence):
+    """Keeps user_data and conversation states in the bot's own database.
+
+    Unlike the stock pickle persistence nothing is rewritten wholesale: a
+    user's data is loaded the first time one of their updates comes in, and
+    on each persistence run only the keys that actually changed since the
+    last write are upserted (or deleted). Values are stored as json.
+    """
+
+    def __init__(self, db, update_interval=5, session_ttl=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.session_ttl = session_ttl #conversations idle longer than this are not restored
+        self._written = {} #user_id -> {key: json as last written}, only for users loaded so far
+
+    #user data ##########################################################################
+
+    async def get_user_data(self):
+        return {} #loaded lazily per user in refresh_user_data
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._written:
+            return
+        stored = await self.db.read(_select_user_data, user_id)
+        self._written[user_id] = stored
+        for key, value in stored.items():
+            user_data.setdefault(key, json.loads(value))
+
+    async def update_user_data(self, user_id, data):
+        current = {key: json.dumps(value, sort_keys=True) for key, value in data.items()}
+        written = self._written.get(user_id)
+        changed = {key: value for key, value in current.items() if written is None or written.get(key) != value}
+        removed = [] if written is None else [key for key in written if key not in current]
+        if not changed and not removed:
+            return
+        await self.db.write(_write_user_data, user_id, changed, removed)
+        self._written[user_id] = current
+
+    async def drop_user_data(self, user_id):
+        self._written.pop(user_id, None)
+        await self.db.write(_delete_user_data, user_id)
+
+    #conversations ######################################################################
+
+    async def get_conversations(self, name):
+        cutoff = time.time() - self.session_ttl if self.session_ttl else 0
+        return await self.db.read(_select_conversations, name, cutoff)
+
+    async def update_conversation(self, name, key, new_state):
+        await self.db.write(_write_conversation, name, json.dumps(list(key)), new_state)
+
+    async def drop_stale(self, cutoff, keep_user_ids=()):
+        #rows nobody touched since cutoff, e.g. carts from a drop before the last restart
+        await self.db.write(_delete_stale, cutoff, list(keep_user_ids))
+
+    #not stored #########################################################################
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass #every update is written as it happens
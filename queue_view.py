@@ -0,0 +1,266 @@
+import asyncio
+from collections import OrderedDict
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden
+
+#telegram limits, message length is counted in utf-16 code units
+MAX_MESSAGE_CHARS = 4096
+MAX_BUTTONS = 100
+
+HEADER_RESERVE = 160 #room for the header lines above the orders
+NAV_BUTTONS = 5 #prev/refresh/next plus the two bulk serve buttons
+
+
+def utf16_len(text):
+    #emoji outside the BMP count twice, len() would count them once
+    return len(text.encode('utf-16-le')) // 2
+
+def utf16_cut(text, units):
+    #at most `units` utf-16 code units of text, never half a surrogate pair
+    return text.encode('utf-16-le')[:units * 2].decode('utf-16-le', errors='ignore')
+
+def order_key(order):
+    return (order['created_at'], order['id'])
+
+def encode_key(key):
+    return f"{key[0]!r}_{key[1]}"
+
+def decode_key(raw):
+    created_at, order_id = raw.split('_', 1)
+    return (float(created_at), order_id)
+
+
+def render_order(order):
+    text = f"🆔 **#{order['id']}** | 👤 {order['customer_name']}\n"
+    for item in order['items']:
+        text += f" - {item['name']}\n"
+        if item.get('request'):
+            text += f"   ⚠️ *Note:* {item['request']}\n"
+
+    text += f"💰 Total: ${order['total']:.2f}\n"
+    text += "-------------------\n"
+    return text
+
+
+class QueuePage:
+    def __init__(self, text, reply_markup=None, anchor=None):
+        self.text = text
+        self.reply_markup = reply_markup
+        self.anchor = anchor #key of the first order shown, None for the first page
+
+    def fingerprint(self):
+        markup = self.reply_markup.to_json() if self.reply_markup else ''
+        return (self.text, markup)
+
+
+class QueueView:
+    """Renders the admin queue a page at a time.
+
+    Pages are addressed by keyset (the (created_at, id) of their first order),
+    so serving orders never shifts what a page means. Rendered pages are cached
+    until the pending queue changes, and each admin message remembers what it
+    is showing so refreshing an unchanged page can skip the edit entirely.
+    A message can also be switched into select mode, where tapping orders
+    picks them for serving together.
+    """
+
+    def __init__(self, pending, page_size=10, remembered_messages=200, serve_batch=5):
+        self.pending = pending
+        self.page_size = min(page_size, MAX_BUTTONS - NAV_BUTTONS)
+        self.remembered_messages = remembered_messages
+        self.serve_batch = serve_batch
+        self._cache = {}
+        self._cache_version = None
+        self._shown = OrderedDict() #(chat_id, message_id) -> (anchor, fingerprint)
+        self._selected = {} #(chat_id, message_id) -> set of order ids, only for messages in select mode
+
+    def render(self, anchor=None, mode='from', selected=None):
+        #mode is 'from' (page starts at anchor), 'after' (just after it) or 'before' (ends before it)
+        if self._cache_version != self.pending.version:
+            self._cache.clear()
+            self._cache_version = self.pending.version
+
+        cache_key = (anchor, mode, None if selected is None else frozenset(selected))
+        page = self._cache.get(cache_key)
+        if page is None:
+            page = self._cache[cache_key] = self._build(anchor, mode, selected)
+        return page
+
+    def _build(self, anchor, mode, selected=None):
+        total = len(self.pending)
+        if not total:
+            return QueuePage("✅ All orders served! The queue is empty.")
+
+        if mode == 'before':
+            orders = self.pending.page_before(anchor, self.page_size)
+            if not orders or self.pending.position(orders[0]) == 1:
+                return self._build(None, 'from', selected) #back at the start, show a full first page
+            orders.reverse() #fill the page from the newest order backwards
+        else:
+            orders = self.pending.page_from(anchor, self.page_size, after=(mode == 'after'))
+            if not orders: #everything from here on was served, step back a page
+                return self._build(anchor, 'before', selected) if anchor else self._build(None, 'from', selected)
+
+        #keep as many orders as fit in one message
+        budget = MAX_MESSAGE_CHARS - HEADER_RESERVE
+        shown, blocks = [], []
+        for order in orders:
+            block = render_order(order)
+            size = utf16_len(block)
+            if size > budget:
+                if not shown: #one huge order, show it cut short rather than not at all
+                    shown.append(order)
+                    blocks.append(utf16_cut(block, budget - 1) + "…")
+                break
+            budget -= size
+            shown.append(order)
+            blocks.append(block)
+        if mode == 'before':
+            shown.reverse()
+            blocks.reverse()
+
+        first = self.pending.position(shown[0])
+        last = first + len(shown) - 1
+
+        text = f"📋 **Active Order Queue**\n{total} pending, showing {first}-{last}\n"
+        if selected is None:
+            keyboard = [[InlineKeyboardButton(f"✅ Serve Order #{o['id']}", callback_data=f"serve_{o['id']}")]
+                        for o in shown]
+            keyboard.append([
+                InlineKeyboardButton("☑️ Select", callback_data="bulk_on"),
+                InlineKeyboardButton(f"⏩ Serve next {min(self.serve_batch, total)}", callback_data=f"bulk_next_{self.serve_batch}"),
+            ])
+        else:
+            picked = sum(1 for order_id in selected if self.pending.get(order_id)) #some may have been served meanwhile
+            text += "Tap orders to pick them, then serve them together.\n"
+            keyboard = [[InlineKeyboardButton(f"{'☑️' if o['id'] in selected else '⬜'} Order #{o['id']}",
+                                              callback_data=f"bulk_pick_{o['id']}")]
+                        for o in shown]
+            keyboard.append([
+                InlineKeyboardButton(f"✅ Serve {picked} picked", callback_data="bulk_serve"),
+                InlineKeyboardButton("✖️ Cancel", callback_data="bulk_off"),
+            ])
+        text += "\n" + ''.join(blocks)
+
+        nav = []
+        if first > 1:
+            nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"queue_prev_{encode_key(order_key(shown[0]))}"))
+        nav.append(InlineKeyboardButton("🔄 Refresh Queue", callback_data="refresh_queue"))
+        if last < total:
+            nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"queue_next_{encode_key(order_key(shown[-1]))}"))
+        keyboard.append(nav)
+
+        page_anchor = None if first == 1 else order_key(shown[0])
+        return QueuePage(text, InlineKeyboardMarkup(keyboard), page_anchor)
+
+    #which page each admin message shows, so refresh/serve re-render in place
+    def anchor_for(self, chat_id, message_id):
+        shown = self._shown.get((chat_id, message_id))
+        return shown[0] if shown else None
+
+    def is_shown(self, chat_id, message_id, page):
+        shown = self._shown.get((chat_id, message_id))
+        return shown is not None and shown[1] == page.fingerprint()
+
+    #select mode, per admin message
+    def selection(self, chat_id, message_id):
+        return self._selected.get((chat_id, message_id))
+
+    def start_selecting(self, chat_id, message_id):
+        self._selected.setdefault((chat_id, message_id), set())
+
+    def toggle(self, chat_id, message_id, order_id):
+        picked = self._selected.setdefault((chat_id, message_id), set())
+        picked.symmetric_difference_update({order_id})
+
+    def stop_selecting(self, chat_id, message_id):
+        return self._selected.pop((chat_id, message_id), set())
+
+    def remember(self, chat_id, message_id, page):
+        self._shown[(chat_id, message_id)] = (page.anchor, page.fingerprint())
+        self._shown.move_to_end((chat_id, message_id))
+        while len(self._shown) > self.remembered_messages:
+            forgotten, _ = self._shown.popitem(last=False)
+            self._selected.pop(forgotten, None)
+
+
+class LiveQueue:
+    """Keeps each admin's latest /queue message up to date by itself.
+
+    Changes to the pending orders are coalesced: the first one schedules a
+    refresh `debounce` seconds later and anything arriving meanwhile rides
+    along, so a burst of checkouts costs each admin one edit. Messages whose
+    rendered page is identical to what they already show are not edited.
+    """
+
+    def __init__(self, view, debounce=1.0, limiter=None):
+        self.view = view
+        self.debounce = debounce
+        self.limiter = limiter #shared with the outbox so edits count against the same flood limits
+        self.bot = None
+        self.edits = 0
+        self.skipped = 0
+        self._messages = {} #admin chat_id -> message_id of their live queue
+        self._timer = None
+        self._refreshing = None
+        view.pending.listener = self.changed
+
+    def start(self, bot):
+        self.bot = bot
+
+    async def stop(self):
+        self.bot = None
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._refreshing: #an edit in flight would otherwise outlive the bot's http client
+            self._refreshing.cancel()
+            await asyncio.gather(self._refreshing, return_exceptions=True)
+            self._refreshing = None
+
+    def track(self, chat_id, message_id):
+        self._messages[chat_id] = message_id #only the newest /queue per admin stays live
+
+    def changed(self):
+        if self.bot is None or self._timer is not None or not self._messages:
+            return
+        self._timer = asyncio.get_running_loop().call_later(self.debounce, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        if self._refreshing and not self._refreshing.done(): #still editing, go again once that is done
+            self.changed()
+            return
+        self._refreshing = asyncio.create_task(self.refresh())
+
+    async def refresh(self):
+        await asyncio.gather(*(self._refresh_one(chat_id, message_id) for chat_id, message_id in list(self._messages.items())))
+
+    async def _refresh_one(self, chat_id, message_id):
+        view = self.view
+        page = view.render(view.anchor_for(chat_id, message_id), 'from', view.selection(chat_id, message_id))
+        if view.is_shown(chat_id, message_id, page):
+            self.skipped += 1
+            return
+        if self.limiter:
+            await self.limiter.acquire(chat_id)
+        try:
+            await self.bot.edit_message_text(page.text, chat_id=chat_id, message_id=message_id,
+                                             reply_markup=page.reply_markup, parse_mode='Markdown')
+            self.edits += 1
+        except BadRequest as e:
+            if 'not modified' not in str(e):
+                print(f"Live queue for {chat_id} stopped: {e}") #message deleted, too old to edit, ...
+                self._untrack(chat_id, message_id)
+                return
+        except Forbidden:
+            self._untrack(chat_id, message_id)
+            return
+        except Exception as e: #network trouble, the next change will try again
+            print(f"Live queue edit for {chat_id} failed: {e}")
+            return
+        view.remember(chat_id, message_id, page)
+
+    def _untrack(self, chat_id, message_id):
+        if self._messages.get(chat_id) == message_id:
+            del self._messages[chat_id]
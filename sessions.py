@@ -0,0 +1,66 @@
+import asyncio
+import resource
+import time
+
+
+class SessionSweeper:
+    """Forgets customers who have gone quiet, so memory stays flat across drops.
+
+    Every update marks its user as seen. Every `interval` seconds the sweeper
+    drops the user_data (cart, half-built bowl) of anyone idle for longer
+    than `ttl`, and clears persisted sessions that old out of the database.
+    The conversation itself is ended by the ConversationHandler's own
+    conversation_timeout, set to the same ttl.
+    """
+
+    def __init__(self, ttl=1800, interval=60):
+        self.ttl = ttl
+        self.interval = interval
+        self.evicted = 0
+        self.app = None
+        self._last_seen = {} #user_id -> time of their last update
+        self._task = None
+
+    async def touch(self, update, context):
+        #registered as a TypeHandler ahead of everything else
+        if update.effective_user:
+            self._last_seen[update.effective_user.id] = time.time()
+
+    def start(self, app):
+        self.app = app
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e: #try again next round
+                print(f"Session sweep failed: {e}")
+
+    async def sweep(self):
+        cutoff = time.time() - self.ttl
+        for user_id in list(self.app.user_data):
+            if self._last_seen.get(user_id, 0) < cutoff:
+                self.app.drop_user_data(user_id) #also removed from the db on the next persistence run
+                self.evicted += 1
+        self._last_seen = {user_id: seen for user_id, seen in self._last_seen.items() if seen >= cutoff}
+        if self.app.persistence:
+            await self.app.persistence.drop_stale(cutoff, list(self.app.user_data)) #e.g. left over from before a restart
+
+    def active(self):
+        cutoff = time.time() - self.ttl
+        return sum(1 for seen in self._last_seen.values() if seen >= cutoff)
+
+    def summary(self):
+        carts = sum(1 for data in self.app.user_data.values() if data.get('cart')) if self.app else 0
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 #kB on linux
+        return (f"{self.active()} active in the last {self.ttl / 60:g} min, "
+                f"{len(self.app.user_data) if self.app else 0} in memory ({carts} with a cart), "
+                f"{self.evicted} evicted, peak memory {peak_mb:.0f}MB")
@@ -0,0 +1,76 @@
+from admission import Admission
+from archive import Archiver
+from outbox import OutboxDispatcher
+from queue_view import LiveQueue, QueueView
+from sessions import SessionSweeper
+
+#what customers and admins read, per shop. {title} and {shopkeeper} come from the shop's
+#config, {TITLE} is the title in capitals; a shop's "texts" config replaces any of these
+TEXTS = {
+    'welcome': "👋 Hello and welcome to {title}! \n\nPlease select an item from the menu below to start your order:",
+    'closed': "🔴 **{TITLE} IS CLOSED** 🔴\n\nSorry, we are not accepting new orders right now :(\nIn the meantime, look out for the next drop in the telegram chat!",
+    'request': "📝 **Any special requests/messages for {shopkeeper}?**\nText it below (e.g., 'No bananas', 'I love {shopkeeper}'), or click the skip button :)",
+    'waitlist': "🕒 **We're at capacity right now!**\n{shopkeeper} is busy making bowls. You're **#{position}** on the waitlist, we'll message you as soon as a spot opens up.",
+    'confirmed': "Thank you for shopping with {title}!",
+    'ready': "🥣 Order #{order_id} is ready!\nThank you for ordering with {title}! 🍓🍌",
+    'access_denied': "⛔️ Access Denied: You are not {shopkeeper}.",
+}
+
+
+class Shop:
+    """Everything that belongs to one shop: its db, menu, admins, queue and background tasks.
+
+    main.py builds one per configured shop and keeps it in that shop's
+    Application as bot_data['shop'], where the handlers look it up. The db
+    threads (see db.Executors), the outbound rate limiter and the metrics are
+    created once and handed to every shop, so many shops can share a process.
+    """
+
+    def __init__(self, name, token, db, menu, admin_ids, limiter, title='Acailability', shopkeeper='Melvin', texts=None,
+                 page_size=10, serve_batch=5, debounce=1.0, max_pending=0, max_per_drop=0, invite_ttl=600,
+                 session_ttl=1800, session_sweep=60, archive_after=3600, archive_interval=300):
+        self.name = name
+        self.token = token
+        self.title = title
+        self.shopkeeper = shopkeeper
+        self.texts = {**TEXTS, **(texts or {})}
+        self.db = db
+        self.menu = menu
+        self.admin_ids = admin_ids
+        self.queue_view = QueueView(db.pending, page_size=page_size, serve_batch=serve_batch)
+        self.outbox = OutboxDispatcher(db, limiter)
+        self.admission = Admission(db, max_pending, max_per_drop, invite_ttl=invite_ttl)
+        self.sessions = SessionSweeper(ttl=session_ttl, interval=session_sweep)
+        self.archiver = Archiver(db, after=archive_after, interval=archive_interval)
+        self.live_queue = LiveQueue(self.queue_view, debounce=debounce, limiter=limiter)
+        self.closing = None #the task closing the shop once bowls sell out, see main.on_stock_change
+
+    def text(self, key, **values):
+        return self.texts[key].format(title=self.title, TITLE=self.title.upper(), shopkeeper=self.shopkeeper, **values)
+
+    def add_gauges(self, metrics):
+        #labelled with the shop, so every shop reports the same metric names side by side
+        label = f'{{shop="{self.name}"}}'
+        gauges = {
+            'pending_orders': lambda: len(self.db.pending),
+            'db_commits_total': lambda: self.db.stats.batches,
+            'db_writes_total': lambda: self.db.stats.writes,
+            'db_max_batch': lambda: self.db.stats.max_batch,
+            'settings_cache_hits_total': lambda: self.db.settings.hits,
+            'settings_db_reads_total': lambda: self.db.settings.db_reads,
+            'outbox_sent_total': lambda: self.outbox.sent,
+            'outbox_retries_total': lambda: self.outbox.retries,
+            'outbox_failed_total': lambda: self.outbox.failed,
+            'outbox_queued': lambda: self.outbox.pending(),
+            'admission_in_flight': lambda: self.admission.in_flight,
+            'admission_drop_orders': lambda: self.admission.drop_orders,
+            'admission_waitlist': lambda: len(self.admission.waitlist),
+            'admission_turned_away_total': lambda: self.admission.turned_away,
+            'sessions_active': lambda: self.sessions.active(),
+            'sessions_evicted_total': lambda: self.sessions.evicted,
+            'archived_orders_total': lambda: self.archiver.archived,
+            'live_queue_edits_total': lambda: self.live_queue.edits,
+            'live_queue_skipped_total': lambda: self.live_queue.skipped,
+        }
+        for name, fn in gauges.items():
+            metrics.gauge(name + label, fn)
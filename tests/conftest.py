@@ -0,0 +1,75 @@
+import asyncio
+import os
+import tempfile
+
+#main.py reads its settings at import time
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:test')
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(), 'import.db'))
+os.environ.setdefault('UPDATE_CONCURRENCY', '1')
+
+import pytest
+from telegram import Update
+import main as bot
+from bench.fake_bot_api import FakeBotAPI, message_update, callback_update
+
+
+class Harness:
+    """One shop running against the fake Bot API, fed updates directly (no polling)."""
+
+    def __init__(self, api, app):
+        self.api = api
+        self.app = app
+        self.shop = app.bot_data['shop']
+
+    async def feed(self, update):
+        await self.app.process_update(Update.de_json(update, self.app.bot))
+
+    def calls(self, chat_id, method=None):
+        return [c for c in self.api.calls if c.chat_id == chat_id and (method is None or c.method == method)]
+
+    def last(self, chat_id, method=None):
+        return self.calls(chat_id, method)[-1]
+
+    async def say(self, user_id, text):
+        await self.feed(message_update(self.api, user_id, text))
+        return self.last(user_id)
+
+    async def tap(self, user_id, message, data):
+        await self.feed(callback_update(self.api, user_id, message, data))
+        return self.last(user_id)
+
+    def alerts(self):
+        return [c.params.get('text') for c in self.api.calls if c.method == 'answerCallbackQuery' and c.params.get('text')]
+
+    async def order(self, user_id, *taps):
+        #/start, the given menu taps, then checkout; returns the confirmation
+        message = (await self.say(user_id, '/start')).result
+        for data in (*taps, 'view_cart'):
+            reply = await self.tap(user_id, message, data)
+        checkout = next(b for b in reply.buttons() if b.startswith('checkout'))
+        return await self.tap(user_id, message, checkout)
+
+
+@pytest.fixture
+def run_shop(tmp_path, monkeypatch):
+    """run_shop(scenario, **config) runs `async scenario(harness)` against a fresh shop."""
+    def run(scenario, **config):
+        async def main():
+            api = await FakeBotAPI().start()
+            monkeypatch.setattr(bot, 'API_URL', api.url)
+            shop = bot.make_shop({'name': 'test', 'token': '123456:test', 'db_path': str(tmp_path / 'shop.db'),
+                                  'admin_ids': [1], **config})
+            shop.db.init()
+            app = bot.build_app(shop)
+            await app.initialize()
+            await bot.startup(app)
+            await app.start()
+            try:
+                return await scenario(Harness(api, app))
+            finally:
+                await app.stop()
+                await app.shutdown()
+                await bot.shutdown(app)
+                await api.stop()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,160 @@
+import asyncio
+import time
+
+from admission import Admission
+
+
+class FakeDB:
+    def __init__(self, **settings):
+        self.settings = {key: str(value) for key, value in settings.items()}
+        self.pending = []
+        self.waitlist = []
+        self.invited = []
+
+    def get_setting(self, key, default=None):
+        return self.settings.get(key, default)
+
+    async def set_setting(self, key, value):
+        self.settings[key] = str(value)
+
+    async def count_orders_since(self, started):
+        return 0
+
+    async def get_waitlist(self):
+        return []
+
+    async def join_waitlist(self, user_id, chat_id, joined_at):
+        self.waitlist.append(user_id)
+
+    async def leave_waitlist(self, user_ids, messages):
+        self.invited.extend(user_ids)
+
+
+def make_admission(invite_ttl=600, **settings):
+    db = FakeDB(**settings)
+    admission = Admission(db, invite_ttl=invite_ttl)
+    asyncio.run(admission.load())
+    return db, admission
+
+
+def checkout(admission, user_id, ordered=True):
+    #reserve, "write" the order, release
+    if not admission.reserve(user_id):
+        return False
+    if ordered:
+        admission.db.pending.append(user_id)
+    admission.release(user_id, ordered)
+    return ordered
+
+
+def test_pending_cap_turns_away_the_rest():
+    db, admission = make_admission(max_pending=2)
+    assert [checkout(admission, user_id) for user_id in (1, 2, 3)] == [True, True, False]
+    assert admission.in_flight == 0
+
+
+def test_slot_is_held_while_checking_out():
+    db, admission = make_admission(max_pending=1)
+    assert admission.reserve(1)
+    assert not admission.reserve(2) #1 has not committed yet, but holds the only slot
+    admission.release(1, ordered=False)
+    assert admission.reserve(2)
+
+
+def test_drop_cap_counts_orders_not_attempts():
+    db, admission = make_admission(max_per_drop=2)
+    assert not checkout(admission, 1, ordered=False)
+    assert checkout(admission, 2) and checkout(admission, 3)
+    assert admission.drop_full() and not admission.can_enter(4)
+    asyncio.run(admission.new_drop())
+    assert admission.can_enter(4)
+
+
+def test_waitlist_is_invited_in_order():
+    db, admission = make_admission(max_pending=1)
+    checkout(admission, 1)
+
+    async def main():
+        for user_id in (5, 3, 4):
+            await admission.wait(user_id, user_id)
+        assert await admission.wait(3, 3) == 2 #asking again keeps their place
+        db.pending.clear() #1 was served
+        await admission.refill()
+        assert db.invited == [5]
+        assert admission.can_enter(5) and not admission.can_enter(3) #5's slot is held for them
+        assert checkout(admission, 5)
+        db.pending.clear() #5 was served, the slot goes to the next in line
+        await admission.refill()
+
+    asyncio.run(main())
+    assert db.invited == [5, 3]
+    assert admission.position(4) == 1
+
+
+def test_invite_expires():
+    db, admission = make_admission(max_pending=1)
+
+    async def main():
+        await admission.wait(5, 5)
+        await admission.wait(6, 6)
+        await admission.refill()
+        assert not admission.can_enter(6)
+        admission.invites[5] = time.time() - 1 #invite_ttl has passed
+        assert not admission.can_enter(9) #noticing the lapse hands the slot to 6, not to a newcomer
+        await asyncio.sleep(0)
+        assert admission.can_enter(6)
+        await admission.stop()
+
+    asyncio.run(main())
+    assert db.invited == [5, 6]
+    assert 5 not in admission.invites
+
+
+def test_lapsed_invite_goes_to_the_next_in_line_by_itself():
+    db, admission = make_admission(max_pending=1, invite_ttl=0.05)
+
+    async def main():
+        await admission.wait(5, 5)
+        await admission.wait(6, 6)
+        await admission.refill()
+        assert db.invited == [5]
+        await asyncio.sleep(0.5) #nobody sends /start meanwhile
+        await admission.stop()
+
+    asyncio.run(main())
+    assert db.invited == [5, 6]
+    assert list(admission.invites) == [] #6 let theirs lapse too
+
+
+def test_failed_checkout_slot_goes_to_the_waitlist():
+    db, admission = make_admission(max_pending=1)
+
+    async def main():
+        assert admission.reserve(1)
+        await admission.wait(7, 7) #turned away while 1 checks out
+        admission.release(1, ordered=False) #e.g. sold out
+        assert not admission.can_enter(9) #a newcomer doesn't jump the line
+        await asyncio.sleep(0)
+        assert db.invited == [7]
+        assert admission.can_enter(7) and not admission.can_enter(9)
+        await admission.stop()
+
+    asyncio.run(main())
+
+
+def test_invited_checkout_is_counted_once():
+    db, admission = make_admission(max_pending=2)
+
+    async def main():
+        await admission.wait(5, 5)
+        await admission.refill()
+
+    asyncio.run(main())
+    assert admission.reserve(5)
+    #5 holds one slot (in flight, not also as an invite), so there is still room for 6
+    assert admission.can_enter(6)
+    db.pending.append(5)
+    admission.release(5, ordered=True)
+    assert 5 not in admission.invites
+    assert checkout(admission, 6)
+    assert not admission.can_enter(7)
@@ -0,0 +1,55 @@
+import asyncio
+import sqlite3
+
+
+def order_count(shop):
+    conn = sqlite3.connect(shop.db.path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    finally:
+        conn.close()
+
+
+async def cart_with_checkout(h, user_id):
+    #/start, one bowl, view_cart; returns the cart message and its checkout button
+    message = (await h.say(user_id, '/start')).result
+    await h.tap(user_id, message, 'm:b')
+    cart = await h.tap(user_id, message, 'view_cart')
+    return message, next(b for b in cart.buttons() if b.startswith('checkout'))
+
+
+def test_repeat_tap_confirms_the_same_order(run_shop):
+    async def scenario(h):
+        message, checkout = await cart_with_checkout(h, 10)
+        first = await h.tap(10, message, checkout)
+        again = await h.tap(10, message, checkout)
+        return first.params['text'], again.params['text'], order_count(h.shop), len(h.shop.db.pending)
+
+    first, again, stored, pending = run_shop(scenario)
+    assert 'Order ID: #1' in first
+    assert again == first
+    assert (stored, pending) == (1, 1)
+
+
+def test_concurrent_taps_place_one_order(run_shop):
+    async def scenario(h):
+        message, checkout = await cart_with_checkout(h, 10)
+        add_order = h.shop.db.add_order
+        raced = []
+        async def counted(*args, **kwargs):
+            try:
+                return await add_order(*args, **kwargs)
+            except sqlite3.IntegrityError:
+                raced.append(kwargs['checkout_key'])
+                raise
+        h.shop.db.add_order = counted
+        #both taps get past the "already placed?" lookup before either insert lands
+        await asyncio.gather(h.tap(10, message, checkout), h.tap(10, message, checkout))
+        confirmations = [c.params['text'] for c in h.calls(10, 'editMessageText') if 'Order Confirmed' in c.params['text']]
+        return raced, confirmations, order_count(h.shop), h.shop.admission.in_flight
+
+    raced, confirmations, stored, in_flight = run_shop(scenario)
+    assert len(raced) == 1
+    assert len(confirmations) == 2 and all('Order ID: #1' in text for text in confirmations)
+    assert stored == 1
+    assert in_flight == 0
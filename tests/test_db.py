@@ -0,0 +1,36 @@
+import sqlite3
+import time
+from db import MIGRATIONS
+
+
+def baseline_db(tmp_path):
+    #a database as the first version of the bot left it
+    conn = sqlite3.connect(tmp_path / 'old.db', isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    MIGRATIONS[0](conn)
+    for n in range(3):
+        conn.execute("INSERT INTO orders (id, customer_id, customer_name, items, total, status) VALUES (?, 1, 'x', '[]', 6.0, 'pending')",
+                     (f"old{n}",))
+    return conn
+
+
+def test_legacy_orders_get_real_timestamps_in_rowid_order(tmp_path):
+    conn = baseline_db(tmp_path)
+    before = time.time()
+    MIGRATIONS[1](conn)
+    rows = conn.execute("SELECT id, created_at FROM orders ORDER BY rowid").fetchall()
+    stamps = [row['created_at'] for row in rows]
+    assert stamps == sorted(stamps) and len(set(stamps)) == 3
+    assert before - 1 < stamps[0] <= stamps[-1] <= time.time()
+
+
+def test_legacy_sales_are_dated_and_toppings_carry_no_revenue(tmp_path):
+    conn = baseline_db(tmp_path)
+    conn.execute("""UPDATE orders SET status='served',
+                    items='[{"name": "Classic Acai Bowl (Matcha, Honey Drizzle)", "price": 6.0}]' WHERE id='old0'""")
+    for step in MIGRATIONS[1:]:
+        step(conn)
+    assert [tuple(r) for r in conn.execute("SELECT day, orders, bowls, revenue FROM sales_daily")] == \
+        [(time.strftime('%Y-%m-%d'), 1, 1, 6.0)]
+    revenue = {row['kind']: row['revenue'] for row in conn.execute("SELECT kind, revenue FROM sales_components")}
+    assert revenue == {'item': 6.0, 'granola': 0, 'drizzle': 0}
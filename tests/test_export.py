@@ -0,0 +1,38 @@
+import time
+from datetime import date, timedelta
+
+import export
+from db import MIGRATIONS
+from tests.test_db import baseline_db
+
+
+def test_single_date_exports_from_that_day_on(run_shop):
+    yesterday = date.today() - timedelta(days=1)
+
+    async def scenario(h):
+        await h.order(10, 'm:b')
+        await h.order(11, 'm:b')
+        since = await h.say(1, f'/export {yesterday}')
+        only = await h.say(1, f'/export {yesterday} {yesterday}')
+        return since.params, only.params
+
+    since, only = run_shop(scenario)
+    assert since['caption'] == '📦 2 orders (all)'
+    assert since['document']['filename'] == f'orders-all-{yesterday:%Y%m%d}-now.csv'
+    assert only['text'] == '📦 No orders match that export.'
+
+
+def test_export_walks_orders_by_index(tmp_path):
+    #no full sort of every matching row up front, memory stays flat however big the export
+    conn = baseline_db(tmp_path)
+    for step in MIGRATIONS[1:]:
+        step(conn)
+    queries = []
+    conn.set_trace_callback(lambda sql: queries.append(sql) if 'FROM orders' in sql else None)
+    for status in ('all', 'pending'):
+        list(export._item_rows(conn, 0, time.time() + 1, status))
+    conn.set_trace_callback(None)
+    assert queries
+    for sql in queries:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        assert not any(step.startswith('SCAN o') or step == 'USE TEMP B-TREE FOR ORDER BY' for step in plan), plan
@@ -0,0 +1,52 @@
+import asyncio
+from outbox import OutboxDispatcher, RateLimiter, message
+
+
+class FakeDB:
+    def __init__(self, fail_sent=0):
+        self.fail_sent = fail_sent
+        self.sent = []
+        self.outbox_listener = None
+
+    async def get_queued_messages(self):
+        return []
+
+    async def message_sent(self, row_id):
+        if self.fail_sent:
+            self.fail_sent -= 1
+            raise RuntimeError("database is locked")
+        self.sent.append(row_id)
+
+
+class FakeBot:
+    def __init__(self):
+        self.texts = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.texts.append((chat_id, text))
+
+
+def rows(*chat_ids, first_id=0):
+    return [dict(message(chat_id, f"hi {i}"), id=i, attempts=0) for i, chat_id in enumerate(chat_ids, first_id)]
+
+
+def test_worker_survives_db_error():
+    async def run():
+        db, bot = FakeDB(fail_sent=1), FakeBot()
+        outbox = OutboxDispatcher(db, RateLimiter(global_rate=1000, chat_rate=1000, chat_burst=1000),
+                                  concurrency=1, base_backoff=0.01)
+        await outbox.start(bot)
+        outbox.push(rows(5, 6))
+        await asyncio.sleep(0.2)
+        outbox.push(rows(5, first_id=2)) #a later message to the same chat still goes out
+        await asyncio.sleep(0.2)
+        await outbox.stop()
+        return db, bot, outbox
+
+    db, bot, outbox = asyncio.run(run())
+    assert outbox.pending() == 0
+    assert not outbox._chats
+    assert sorted(db.sent) == [0, 1, 2]
+    #only the failed db write was retried, the customer got each message once
+    assert sorted(bot.texts) == [(5, 'hi 0'), (5, 'hi 2'), (6, 'hi 1')]
+    assert outbox.sent == 3
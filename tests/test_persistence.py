@@ -0,0 +1,44 @@
+import asyncio
+
+from persistence import SQLitePersistence
+
+
+class FakeDB:
+    def __init__(self, stored):
+        self.stored = stored #user_id -> {key: json}
+        self.writes = []
+
+    async def read(self, fn, *args):
+        return dict(self.stored.get(args[0], {}))
+
+    async def write(self, fn, *args):
+        self.writes.append((fn.__name__, *args))
+
+
+def test_only_changed_keys_are_written():
+    db = FakeDB({7: {'cart': '[]', 'name': '"mel"'}})
+    persistence = SQLitePersistence(db)
+
+    async def main():
+        data = {}
+        await persistence.refresh_user_data(7, data)
+        assert data == {'cart': [], 'name': 'mel'}
+        await persistence.update_user_data(7, data) #nothing changed since the load
+        data['cart'] = [{'name': 'Classic', 'price': 6.0}]
+        await persistence.update_user_data(7, data)
+        await persistence.update_user_data(7, data) #already written
+        del data['name']
+        await persistence.update_user_data(7, data)
+
+    asyncio.run(main())
+    assert db.writes == [
+        ('_write_user_data', 7, {'cart': '[{"name": "Classic", "price": 6.0}]'}, []),
+        ('_write_user_data', 7, {}, ['name']),
+    ]
+
+
+def test_unloaded_user_writes_everything():
+    db = FakeDB({})
+    persistence = SQLitePersistence(db)
+    asyncio.run(persistence.update_user_data(8, {'cart': []}))
+    assert db.writes == [('_write_user_data', 8, {'cart': '[]'}, [])]
@@ -0,0 +1,11 @@
+def test_combos_only_when_a_bowl_was_customized(run_shop):
+    async def scenario(h):
+        await h.order(10, 'm:b')
+        plain = (await h.say(1, '/prep')).params['text']
+        await h.order(11, 'm:a', 'g:mt', 'd:hn', 'skip_request')
+        mixed = (await h.say(1, '/prep')).params['text']
+        return plain, mixed
+
+    plain, mixed = run_shop(scenario)
+    assert 'Combos' not in plain and '1 x Banana Pudding Acai' in plain
+    assert '**Combos**\n1 x Classic Acai Bowl, Matcha, Honey\n' in mixed
@@ -0,0 +1,90 @@
+import asyncio
+
+from db import PendingOrders
+from queue_view import MAX_MESSAGE_CHARS, LiveQueue, QueueView, utf16_len
+
+
+def test_queue_actions_are_admin_only(run_shop):
+    async def scenario(h):
+        for user_id in (10, 11):
+            await h.order(user_id, 'm:b')
+        queue = (await h.say(1, '/queue')).result
+        await h.tap(10, queue, 'bulk_next_1000') #forged by a customer
+        await h.tap(10, queue, 'serve_1')
+        return h.alerts(), len(h.shop.db.pending)
+
+    alerts, pending = run_shop(scenario)
+    assert pending == 2
+    assert any('Access Denied' in text for text in alerts)
+
+
+def test_serve_next_uses_the_configured_batch(run_shop, monkeypatch):
+    monkeypatch.setenv('SERVE_BATCH', '3')
+
+    async def scenario(h):
+        for user_id in range(10, 15):
+            await h.order(user_id, 'm:b')
+        queue = (await h.say(1, '/queue')).result
+        await h.tap(1, queue, 'bulk_next_1000') #whatever N the button says
+        return [o['id'] for o in h.shop.db.pending.orders()]
+
+    assert run_shop(scenario) == ['4', '5']
+
+
+class SlowBot:
+    def __init__(self):
+        self.editing = asyncio.Event()
+
+    async def edit_message_text(self, *args, **kwargs):
+        self.editing.set()
+        await asyncio.sleep(60) #telegram taking its time
+
+
+class FakeView:
+    def __init__(self):
+        self.pending = type('Pending', (), {'listener': None})()
+
+    def render(self, *args):
+        return type('Page', (), {'text': 'queue', 'reply_markup': None})()
+
+    def anchor_for(self, chat_id, message_id):
+        return None
+
+    def selection(self, chat_id, message_id):
+        return None
+
+    def is_shown(self, chat_id, message_id, page):
+        return False
+
+
+def test_stop_cancels_a_refresh_in_flight():
+    async def main():
+        bot = SlowBot()
+        live = LiveQueue(FakeView(), debounce=0)
+        live.start(bot)
+        live.track(1, 100)
+        live.changed()
+        await asyncio.wait_for(bot.editing.wait(), 1)
+        refreshing = live._refreshing
+        await asyncio.wait_for(live.stop(), 1)
+        return refreshing
+
+    refreshing = asyncio.run(main())
+    assert refreshing.cancelled()
+
+
+def emoji_order(n, request_length):
+    return {'id': str(n), 'customer_id': n, 'customer_name': '🍓🍌' * 5, 'total': 7.0, 'created_at': float(n),
+            'checkout_key': None, 'items': [{'name': 'Banana Pudding Acai', 'price': 7.0, 'request': '🍓' * request_length}]}
+
+
+def test_pages_fit_telegrams_utf16_limit():
+    pending = PendingOrders()
+    pending.load([emoji_order(n, 300) for n in range(1, 11)])
+    page = QueueView(pending, page_size=10).render()
+    assert utf16_len(page.text) <= MAX_MESSAGE_CHARS
+    assert 'showing 1-' in page.text and 'showing 1-10' not in page.text #by code points all ten would have "fit"
+
+    pending.load([emoji_order(1, 3000)]) #one order too big for a message on its own
+    page = QueueView(pending).render()
+    assert utf16_len(page.text) <= MAX_MESSAGE_CHARS and page.text.rstrip().endswith('…')
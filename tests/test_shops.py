@@ -0,0 +1,39 @@
+import re
+
+from metrics import Metrics
+
+
+def test_texts_come_from_the_shop_config(run_shop):
+    async def scenario(h):
+        welcome = await h.say(10, '/start')
+        denied = await h.say(10, '/queue')
+        await h.say(1, '/toggleshop')
+        closed = await h.say(11, '/start')
+        return welcome.params['text'], denied.params['text'], closed.params['text']
+
+    welcome, denied, closed = run_shop(scenario, title='Toast Corner', shopkeeper='Auntie Lim',
+                                       texts={'closed': "{title} is closed, {shopkeeper} went home"})
+    assert 'welcome to Toast Corner!' in welcome
+    assert denied == '⛔️ Access Denied: You are not Auntie Lim.'
+    assert closed == 'Toast Corner is closed, Auntie Lim went home'
+
+
+def test_histograms_are_kept_per_shop():
+    metrics = Metrics()
+    metrics.observe('handler', 'start_command', 0.002, shop='acai')
+    metrics.observe('handler', 'start_command', 0.002, shop='acai')
+    metrics.observe('handler', 'start_command', 0.002, shop='toast')
+    [acai] = metrics.summary('handler', 'acai')
+    [toast] = metrics.summary('handler', 'toast')
+    assert acai.startswith('start_command: 2x') and toast.startswith('start_command: 1x')
+    assert 'acai_handler_seconds_count{name="start_command",shop="toast"} 1' in metrics.prometheus()
+
+
+def test_stats_show_db_latencies(run_shop):
+    async def scenario(h):
+        await h.order(10, 'm:b')
+        return (await h.say(1, '/stats')).params['text']
+
+    stats = run_shop(scenario)
+    db_calls = stats.split('DB calls:\n')[1].split('\n\n')[0]
+    assert re.search(r'^add_order: \d+x p50≤', db_calls, re.M), db_calls #metrics are per process, earlier tests count too
@@ -0,0 +1,53 @@
+import asyncio
+
+import main as bot
+
+
+def test_selling_out_closes_the_shop_once(run_shop):
+    async def scenario(h):
+        shop = h.shop
+        notices = []
+        queue_messages = shop.db.queue_messages
+        async def recorded(messages):
+            notices.extend(messages)
+            return await queue_messages(messages)
+        shop.db.queue_messages = recorded
+
+        for option in shop.menu.options['items']:
+            shop.db.stock[('items', option.key)] = 0
+        #two checkouts that each took a last bowl, reported before the first close has run
+        bot.on_stock_change(shop, {('items', 'classic'): 0})
+        first = shop.closing
+        bot.on_stock_change(shop, {('items', 'classic'): 0})
+        assert shop.closing is first
+        await first
+        return shop.db.is_shop_open(), len(notices)
+
+    is_open, notices = run_shop(scenario)
+    assert not is_open
+    assert notices == 1 #one per admin
+
+
+def test_last_bowl_goes_to_one_of_two_concurrent_checkouts(run_shop):
+    async def scenario(h):
+        await h.say(1, '/setstock bowl banana 1')
+        carts = {}
+        for user_id in (10, 11):
+            message = (await h.say(user_id, '/start')).result
+            await h.tap(user_id, message, 'm:b')
+            cart = await h.tap(user_id, message, 'view_cart')
+            carts[user_id] = (message, next(b for b in cart.buttons() if b.startswith('checkout')))
+        await asyncio.gather(*(h.tap(user_id, message, checkout) for user_id, (message, checkout) in carts.items()))
+        replies = [h.last(user_id, 'editMessageText').params['text'] for user_id in carts]
+        left = await h.shop.db.read(lambda conn: conn.execute(
+            "SELECT quantity FROM stock WHERE kind='items' AND key='banana'").fetchone()[0])
+        #the loser's stock change was rolled back with its savepoint, the winner's committed
+        return replies, len(h.shop.db.pending), h.shop.db.stock[('items', 'banana')], left, h.shop.db.is_shop_open()
+
+    replies, pending, stock, stored, is_open = run_shop(scenario)
+    assert pending == 1
+    assert (stock, stored) == (0, 0)
+    assert sum('Order Confirmed' in text for text in replies) == 1
+    [sold_out] = [text for text in replies if 'Order Confirmed' not in text]
+    assert sold_out == '😢 Sorry, **Banana Pudding Acai** just sold out and was taken out of your cart.\n\nYour cart is empty!'
+    assert is_open #classic bowls are still in stock
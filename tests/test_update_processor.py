@@ -0,0 +1,30 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from update_processor import PerUserUpdateProcessor
+
+
+def update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+
+def test_one_busy_user_does_not_hold_every_slot():
+    async def main():
+        processor = PerUserUpdateProcessor(4)
+        order, finished = [], {}
+
+        async def handle(user_id, n):
+            await asyncio.sleep(0.05)
+            order.append((user_id, n))
+            finished[(user_id, n)] = time.perf_counter()
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(processor.process_update(update(1), handle(1, n))) for n in range(8)]
+        tasks.append(asyncio.create_task(processor.process_update(update(2), handle(2, 0))))
+        await asyncio.gather(*tasks)
+        return order, finished[(2, 0)] - start
+
+    order, other_user = asyncio.run(main())
+    assert [n for user_id, n in order if user_id == 1] == list(range(8)) #still one at a time, in order
+    assert other_user < 0.1 #ran alongside user 1's first update, not after a queue of them
@@ -0,0 +1,53 @@
+import asyncio
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates concurrently, but never two updates from the same user at once.
+
+    ConversationHandler assumes one update per conversation is handled at a
+    time, so a user's updates are queued behind each other (in arrival order)
+    while different users are served in parallel. The queueing happens before
+    a concurrency slot is taken, so one user tapping fast only ever holds one
+    slot and can't stall everyone else.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {} #key -> [lock, number of updates holding or waiting for it]
+
+    @staticmethod
+    def _key(update):
+        if getattr(update, 'effective_user', None):
+            return ('user', update.effective_user.id)
+        if getattr(update, 'effective_chat', None):
+            return ('chat', update.effective_chat.id)
+        return None
+
+    async def process_update(self, update, coroutine):
+        #the user's turn first, then a slot (the base class takes the semaphore)
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]: #fifo, so a user's updates keep their order
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass